@@ -1,5 +1,5 @@
 # app/api/dependencies.py
-from typing import Generator
+from typing import Any, Generator
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -10,6 +10,7 @@ from sqlalchemy.orm import Session
 from app.db.session import SessionLocal
 from app.core.config import settings
 from app.core.security import ALGORITHM
+from app.services import meal as meal_service
 from app.services import user as user_service
 from app.schemas.token import TokenPayload
 
@@ -27,14 +28,33 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+def verify_ownership(
+    db: Session, resource: Any, resource_id: int, user: Any, not_found: str = "Not found"
+) -> None:
+    """
+    Check that a meal, recipe or share belongs to user with a single query.
+    """
+    owner_id = meal_service.get_owner_id(db, resource, resource_id)
+    if owner_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=not_found
+        )
+    if owner_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+
 # app/api/router.py
 from fastapi import APIRouter
 
-from app.api.endpoints import auth, users, meals, recipes, ingredients, ml, social
+from app.api.endpoints import auth, users, meals, recipes, ingredients, ml, social, health
 
 api_router = APIRouter()
 
 # Include subrouters
+api_router.include_router(health.router, prefix="/health", tags=["health"])
 api_router.include_router(auth.router, prefix="/auth", tags=["auth"])
 api_router.include_router(users.router, prefix="/users", tags=["users"])
 api_router.include_router(meals.router, prefix="/meals", tags=["meals"])
@@ -44,8 +64,10 @@ api_router.include_router(ml.router, prefix="/ml", tags=["ml"])
 api_router.include_router(social.router, prefix="/social", tags=["social"])
 
 # app/core/security.py
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
-from typing import Any, Union, Optional
+from typing import Any, Callable, Union, Optional, Tuple
 
 from jose import jwt
 from passlib.context import CryptContext
@@ -54,14 +76,35 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 
 from app.api.dependencies import get_db, reusable_oauth2
+from app.core.cache import SharedVersion, TTLCache
 from app.core.config import settings
 from app.services import user as user_service
 from app.schemas.token import TokenPayload
 from app.models.user import User
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+)
 ALGORITHM = "HS256"
 
+# bcrypt is pure CPU; run it in worker processes so it neither holds the GIL
+# nor ties up more than workers + queue request threads
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_pool_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(
+    max(1, settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE)
+)
+
+# Detached User rows keyed by token subject, cleared in every worker
+# when one of them changes a user
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_MAX_ENTRIES,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    shared_version=SharedVersion(settings.PRINCIPAL_CACHE_VERSION_FILE, settings.CACHE_VERSION_CHECK_SECONDS),
+)
+
 def create_access_token(
     subject: Union[str, Any], expires_delta: Optional[timedelta] = None
 ) -> str:
@@ -78,17 +121,67 @@ def create_access_token(
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+def _get_hash_pool() -> ProcessPoolExecutor:
+    global _hash_pool
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                _hash_pool = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+    return _hash_pool
+
+def _run_hashing(fn: Callable, *args: Any) -> Any:
+    if settings.PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    
+    # Reject immediately instead of letting a login burst queue up threads
+    if not _hash_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        future: Future = _get_hash_pool().submit(fn, *args)
+    except Exception:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    
+    try:
+        return future.result(timeout=settings.PASSWORD_HASH_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
     Verify password.
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verify password and return a replacement hash if the stored one uses
+    outdated cost settings.
+    """
+    return _run_hashing(_verify_and_update, plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """
     Hash a password.
     """
-    return pwd_context.hash(password)
+    return _run_hashing(_hash_password, password)
 
 def get_current_user(
     db: Session = Depends(get_db), token: str = Depends(reusable_oauth2)
@@ -106,10 +199,37 @@ def get_current_user(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
+    cached_user = principal_cache.get(token_data.sub)
+    if cached_user is not None:
+        # Attach a copy to this session without a SELECT
+        return db.merge(cached_user, load=False)
+    
     user = user_service.get_user(db, id=token_data.sub)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    db.expunge(user)
+    principal_cache.set(token_data.sub, user)
+    return db.merge(user, load=False)
+
+def get_current_superuser(
+    current_user: User = Depends(get_current_user),
+) -> User:
+    """
+    Get current user, requiring superuser rights.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+def invalidate_principal(user_id: int) -> None:
+    """
+    Drop a cached principal after the user row changes.
+    """
+    principal_cache.pop(user_id)
+    principal_cache.invalidate_everywhere()
 
 # app/core/config.py
 import secrets
@@ -144,7 +264,9 @@ class Settings(BaseSettings):
     POSTGRES_USER: str = "postgres"
     POSTGRES_PASSWORD: str = "postgres"
     POSTGRES_DB: str = "recipe_optimizer"
-    DATABASE_URI: Optional[PostgresDsn] = None
+    # Any SQLAlchemy URL; assembled from the POSTGRES_* settings when unset
+    # (the benchmarks point it at SQLite)
+    DATABASE_URI: Optional[Union[PostgresDsn, str]] = None
 
     @validator("DATABASE_URI", pre=True)
     def assemble_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
@@ -158,8 +280,1024 @@ class Settings(BaseSettings):
             path=f"/{values.get('POSTGRES_DB') or ''}",
         )
 
+    # Startup behaviour. Tables are normally managed by alembic; the ML
+    # stack is imported lazily and optionally pre-warmed after startup.
+    # Under gunicorn the master creates the tables once, not each worker.
+    CREATE_TABLES_ON_STARTUP: bool = True
+    ML_PREWARM_ON_STARTUP: bool = True
+
+    # Number of top-rated recipes per meal whose optimizations are
+    # precomputed in the background after a model is trained (0 disables)
+    ML_PRECOMPUTE_TOP_N: int = 5
+
+    # Per-meal nearest-neighbour recipe indexes kept in memory
+    SIMILARITY_INDEX_MAX_MEALS: int = 1024
+    SIMILARITY_INDEX_TTL_SECONDS: int = 3600
+
+    # Novel recipe suggestion search: hard caps on candidates scored and
+    # wall time per request, and the vectorized scoring batch size
+    SUGGESTION_MAX_CANDIDATES: int = 5000
+    SUGGESTION_TIME_BUDGET_SECONDS: float = 2.0
+    SUGGESTION_BATCH_SIZE: int = 512
+    
+    # Response curves: most rows (curve points plus interaction grid
+    # cells) scored for one request
+    RESPONSE_CURVE_MAX_ROWS: int = 10000
+
+    # Pooled per-user model with meal-level effects. For requests with no
+    # model_type or model_type=auto, meals with fewer recipes than the
+    # threshold are served by it instead of training (and storing) a model
+    # of their own.
+    ML_POOLED_MODEL_ENABLED: bool = True
+    ML_POOLED_MIN_MEAL_RECIPES: int = 5
+
+    # Per-meal columnar feature store (one .npz per meal), patched on
+    # recipe writes so ML requests never rebuild features from the database
+    FEATURE_STORE_DIR: str = "./feature_store"
+    FEATURE_STORE_CACHE_MEALS: int = 256
+
+    # Admission control for ML endpoints: concurrent ML requests overall
+    # and per user, and how many may queue (and for how long) beyond that
+    ML_MAX_CONCURRENT_REQUESTS: int = 4
+    ML_MAX_CONCURRENT_REQUESTS_PER_USER: int = 2
+    ML_MAX_QUEUED_REQUESTS: int = 16
+    ML_QUEUE_TIMEOUT_SECONDS: float = 5.0
+
+    # Post-training model compaction: forests are pruned while out-of-bag
+    # MSE stays within ML_COMPACT_TOLERANCE (relative) of the full forest,
+    # and inference switches to float32 when predictions move by at most
+    # ML_COMPACT_FLOAT32_MAX_ERROR rating points
+    ML_COMPACT_MODELS: bool = True
+    ML_COMPACT_TOLERANCE: float = 0.02
+    ML_COMPACT_MIN_TREES: int = 10
+    ML_COMPACT_FLOAT32_MAX_ERROR: float = 1e-3
+
+    # Loaded models kept per process, and how many of the most used ones
+    # (by access counts decaying with the given half-life) are preloaded.
+    # By default each worker loads them on the prewarm thread once it is
+    # serving; ML_PRELOAD_IN_MASTER has the prefork master load them before
+    # forking instead, so workers share them copy-on-write at the cost of a
+    # slower cold start
+    ML_MODEL_CACHE_SIZE: int = 64
+    ML_PRELOAD_MODELS: int = 32
+    ML_PRELOAD_IN_MASTER: bool = False
+    ML_ACCESS_STATS_FLUSH_SECONDS: float = 60.0
+    ML_ACCESS_STATS_HALF_LIFE_HOURS: float = 24.0
+
+    # Prediction cache keyed by model version and feature vector: a
+    # per-process LRU in front of a SQLite file shared by the workers on
+    # this host (an empty path keeps the cache process-local)
+    PREDICTION_CACHE_ENABLED: bool = True
+    PREDICTION_CACHE_PATH: str = "./prediction_cache.sqlite3"
+    PREDICTION_CACHE_TTL_SECONDS: int = 3600
+    PREDICTION_CACHE_LOCAL_ENTRIES: int = 10000
+    PREDICTION_CACHE_MAX_ENTRIES: int = 200000
+
+    # SQL instrumentation: per-request statement counts and DB time, and
+    # the threshold above which a statement is logged with its route
+    DB_QUERY_STATS_ENABLED: bool = True
+    DB_SLOW_QUERY_MS: float = 200.0
+
+    # Expose Prometheus text metrics at /metrics
+    METRICS_ENABLED: bool = True
+
+    # Sampling profiler that superusers arm for the next N requests to a
+    # route; profiles are written to PROFILE_DIR as folded stacks
+    PROFILING_ENABLED: bool = True
+    PROFILE_DIR: str = "./profiles"
+    PROFILE_SAMPLE_INTERVAL_MS: float = 5.0
+    PROFILE_MAX_REQUESTS: int = 20
+
+    # Large list responses are compressed when at least this many bytes
+    # (0 disables); the level applies to gzip (1-9) and brotli (0-11)
+    RESPONSE_COMPRESSION_MIN_BYTES: int = 4096
+    RESPONSE_COMPRESSION_LEVEL: int = 5
+
+    # Profile images are streamed to IMAGE_STORAGE_DIR (at most
+    # PROFILE_IMAGE_MAX_BYTES) and resized to PROFILE_IMAGE_SIZES on a pool
+    # of IMAGE_PROCESS_WORKERS processes (0 resizes on the request thread)
+    IMAGE_STORAGE_DIR: str = "./media"
+    PROFILE_IMAGE_MAX_BYTES: int = 5 * 1024 * 1024
+    PROFILE_IMAGE_SIZES: List[int] = [512, 128]
+    IMAGE_MAX_PIXELS: int = 40_000_000
+    IMAGE_PROCESS_WORKERS: int = 2
+    IMAGE_PROCESS_TIMEOUT_SECONDS: float = 30.0
+    IMAGE_CACHE_MAX_AGE_SECONDS: int = 31536000
+
+    # Password hashing: bcrypt cost and the bounded hashing process pool.
+    # PASSWORD_HASH_WORKERS=0 hashes inline on the calling thread.
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 16
+    PASSWORD_HASH_TIMEOUT_SECONDS: float = 10.0
+
+    # Cross-worker invalidation of the in-process caches below: a writer
+    # bumps the cache's version file and each worker clears its copy once
+    # it sees the change, checking at most every CACHE_VERSION_CHECK_SECONDS
+    CACHE_VERSION_CHECK_SECONDS: float = 1.0
+    PRINCIPAL_CACHE_VERSION_FILE: str = "./principal_cache.version"
+    SHARED_RECIPE_CACHE_VERSION_FILE: str = "./shared_recipe_cache.version"
+
+    # Authenticated principal cache used by get_current_user
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 30
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = 4096
+
+    # In-process ingredient catalog (id -> name/owner/public); writers bump
+    # a shared version file that every worker checks at most every
+    # INGREDIENT_CATALOG_CHECK_SECONDS
+    INGREDIENT_CATALOG_VERSION_FILE: str = "./ingredient_catalog.version"
+    INGREDIENT_CATALOG_CHECK_SECONDS: float = 1.0
+
+    # Public shared-recipe response cache
+    SHARED_RECIPE_CACHE_TTL_SECONDS: int = 300
+    SHARED_RECIPE_CACHE_MAX_ENTRIES: int = 1024
+
+    # Expired share links are deleted in batches of SHARE_SWEEP_BATCH_SIZE
+    # rows every SHARE_SWEEP_INTERVAL_SECONDS (0 disables the sweeper),
+    # pausing between batches and stopping after SHARE_SWEEP_MAX_BATCHES.
+    # Every worker runs the loop, but only the one holding the lock file
+    # sweeps.
+    SHARE_SWEEP_INTERVAL_SECONDS: int = 3600
+    SHARE_SWEEP_BATCH_SIZE: int = 500
+    SHARE_SWEEP_MAX_BATCHES: int = 100
+    SHARE_SWEEP_PAUSE_SECONDS: float = 0.05
+    SHARE_SWEEP_LOCK_FILE: str = "./share_sweep.lock"
+
     class Config:
         case_sensitive = True
         env_file = ".env"
 
 settings = Settings()
+
+# app/core/cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX development machines
+    fcntl = None
+
+class SharedVersion:
+    """
+    Counter kept in a file so every worker process can tell that another
+    one changed shared data. The file is read at most every check_seconds,
+    which bounds how long other workers keep serving stale state.
+    """
+    def __init__(self, path: str, check_seconds: float = 1.0):
+        self.path = path
+        self.check_seconds = check_seconds
+        self._version = 0
+        self._next_check = 0.0
+
+    def read(self) -> int:
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def current(self, recheck: bool = False) -> int:
+        now = time.monotonic()
+        if recheck or now >= self._next_check:
+            self._version = self.read()
+            self._next_check = now + self.check_seconds
+        return self._version
+
+    def bump(self) -> int:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            version = self.read() + 1
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(version))
+            os.replace(tmp_path, self.path)
+        self._version = version
+        self._next_check = time.monotonic() + self.check_seconds
+        return version
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiry. With a
+    shared_version, every process's copy is cleared when any of them
+    calls invalidate_everywhere().
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0,
+                 shared_version: Optional[SharedVersion] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared_version = shared_version
+        self._seen_version: Optional[int] = None
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sync(self) -> None:
+        version = self.shared_version.current()
+        if version != self._seen_version:
+            with self._lock:
+                self._data.clear()
+                self._seen_version = version
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if self.shared_version is not None:
+            self._sync()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self.pop(key)
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def discard_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Drop every entry for which predicate(key, value) is true."""
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def invalidate_everywhere(self) -> None:
+        """
+        Make the other processes sharing this cache's version clear their
+        copies. Drop the affected entries locally first; this process keeps
+        the rest unless it has missed another process's bump.
+        """
+        previous = self._seen_version
+        version = self.shared_version.bump()
+        if previous == version - 1:
+            self._seen_version = version
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+# app/core/concurrency.py
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key onto one execution.
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn, or wait for the in-flight call with the same key.
+        Returns (value, shared); shared is True for callers that waited.
+        Exceptions are re-raised in every caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+class AdmissionController:
+    """
+    Bound concurrent work globally and per key (e.g. user), queueing up to
+    max_queue callers for at most queue_timeout seconds.
+    """
+    def __init__(self, max_concurrent: int, max_per_key: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_per_key = max_per_key
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._running = 0
+        self._waiting = 0
+        self._per_key: Dict[Hashable, int] = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, key: Hashable) -> None:
+        with self._cond:
+            if self._per_key.get(key, 0) >= self.max_per_key:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many concurrent ML requests, please retry",
+                    headers={"Retry-After": "1"},
+                )
+            # Count the caller against its key while queued so one user
+            # cannot fill the queue
+            self._per_key[key] = self._per_key.get(key, 0) + 1
+            if self._running >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self._release_key(key)
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail="ML service is busy, please retry",
+                        headers={"Retry-After": "1"},
+                    )
+                self._waiting += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._running >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._release_key(key)
+                            raise HTTPException(
+                                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="ML service is busy, please retry",
+                                headers={"Retry-After": "1"},
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._running += 1
+
+    def release(self, key: Hashable) -> None:
+        with self._cond:
+            self._running -= 1
+            self._release_key(key)
+            self._cond.notify()
+
+    def _release_key(self, key: Hashable) -> None:
+        count = self._per_key.get(key, 0) - 1
+        if count > 0:
+            self._per_key[key] = count
+        else:
+            self._per_key.pop(key, None)
+
+# app/core/metrics.py
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: List["_Metric"] = []
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def labels(self, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+class Counter(_Metric):
+    """
+    Monotonic counter, rendered in the Prometheus text format.
+    """
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def _render_child(self, key: Tuple[str, ...], child: _CounterChild) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {child.value}"]
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+class Histogram(_Metric):
+    """
+    Cumulative-bucket histogram, rendered in the Prometheus text format.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, key: Tuple[str, ...], child: _HistogramChild) -> List[str]:
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# app/core/serialization.py
+import gzip
+import json
+from datetime import date, datetime
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+from app.core.config import settings
+
+# Optional accelerators: orjson for encoding, brotli for compression
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+def iso(value: Optional[datetime]) -> Optional[str]:
+    """Format a datetime exactly as FastAPI's encoder would."""
+    return value.isoformat() if value is not None else None
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(content: Any) -> bytes:
+    """
+    Encode plain JSON-compatible data with the same output as FastAPI's
+    JSONResponse, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+def json_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """
+    Response for pre-built rows, compressed (brotli if available, else
+    gzip) when the client accepts it and the body is large enough.
+    """
+    body = dumps(content)
+    headers = {}
+    minimum = settings.RESPONSE_COMPRESSION_MIN_BYTES
+    if minimum > 0 and len(body) >= minimum:
+        headers["Vary"] = "Accept-Encoding"
+        accepted = request.headers.get("accept-encoding", "")
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=settings.RESPONSE_COMPRESSION_LEVEL)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=settings.RESPONSE_COMPRESSION_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+# app/core/uploads.py
+import json
+from typing import Any, Callable, Dict
+
+from fastapi import HTTPException, status
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware capping request bodies for the given paths. Declared
+    oversize bodies are refused before any byte is read; chunked ones are
+    cut off as soon as they pass the limit. Both answer 413.
+    """
+    def __init__(self, app: Callable, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        
+        headers = dict(scope.get("headers", []))
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            await self._reject(send, limit)
+            return
+        
+        received = 0
+        started = False
+        
+        async def limited_receive() -> Dict[str, Any]:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI turns other errors raised while parsing a form
+                    # into a 400 but re-raises HTTPException as is
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Request body exceeds {limit} bytes",
+                    )
+            return message
+        
+        async def tracking_send(message: Dict[str, Any]) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as exc:
+            # Only reached when the body is read outside FastAPI's handlers
+            if started or exc.status_code != status.HTTP_413_REQUEST_ENTITY_TOO_LARGE:
+                raise
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send: Callable, limit: int) -> None:
+        body = json.dumps({"detail": f"Request body exceeds {limit} bytes"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# app/core/profiling.py
+import asyncio
+import functools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as FrequencyCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TARGETS_FILE = "targets.json"
+
+# Fast-path flags: a target is armed in some worker, or a profile is running
+# in this one. While both are unset every hook returns immediately.
+_armed = False
+_sessions = 0
+_targets: List[Dict[str, Any]] = []
+_targets_mtime: Optional[int] = None
+_next_refresh = 0.0
+_current: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+
+class ProfileSession:
+    """
+    Samples the stacks of the threads serving one request into folded
+    ("frame;frame;frame count") form, which flamegraph.pl and speedscope read.
+    """
+    def __init__(self, target: Dict[str, Any], method: str, path: str, user_id: Optional[int]):
+        self.target = target
+        self.method = method
+        self.path = path
+        self.user_id = user_id
+        self.interval = target.get("interval_ms", settings.PROFILE_SAMPLE_INTERVAL_MS) / 1000
+        self.samples: FrequencyCounter = FrequencyCounter()
+        self.annotations: List[Dict[str, Any]] = []
+        self.started_at = datetime.utcnow()
+        self._threads: Dict[int, List[str]] = {}
+        self._holds: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+        self._sampler.start()
+
+    def attach(self) -> List[str]:
+        """Sample the calling thread until the matching detach(); returns its stage label stack."""
+        ident = threading.get_ident()
+        with self._lock:
+            self._holds[ident] = self._holds.get(ident, 0) + 1
+            return self._threads.setdefault(ident, [])
+
+    def detach(self) -> None:
+        """Stop sampling the calling thread once every attach() on it is undone."""
+        ident = threading.get_ident()
+        with self._lock:
+            holds = self._holds.pop(ident, 0) - 1
+            if holds > 0:
+                self._holds[ident] = holds
+            else:
+                # Threadpool threads go on to serve other requests
+                self._threads.pop(ident, None)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for ident, stages in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                # Stage labels sit under the request root so flamegraphs group by stage
+                self.samples[";".join([f"{self.method} {self.path}", *stages, *reversed(stack)])] += 1
+
+    def stop(self, status_code: Optional[int]) -> str:
+        self._stop.set()
+        self._sampler.join()
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", self.path).strip("-")
+        name = f"{self.started_at:%Y%m%dT%H%M%S}-{os.getpid()}-{slug}-u{self.user_id}-{uuid.uuid4().hex[:6]}"
+        with open(os.path.join(settings.PROFILE_DIR, f"{name}.folded"), "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(settings.PROFILE_DIR, f"{name}.json"), "w") as f:
+            json.dump({
+                "target": self.target,
+                "method": self.method,
+                "path": self.path,
+                "user_id": self.user_id,
+                "status_code": status_code,
+                "started_at": self.started_at.isoformat(),
+                "duration_ms": duration_ms,
+                "interval_ms": self.interval * 1000,
+                "samples": sum(self.samples.values()),
+                "annotations": self.annotations,
+            }, f, indent=2, default=str)
+        return name
+
+# Armed targets live in a file so every worker process sees them and the
+# "next N requests" budget is shared
+
+def _targets_path() -> str:
+    return os.path.join(settings.PROFILE_DIR, TARGETS_FILE)
+
+@contextmanager
+def _locked_targets() -> Iterator[List[Dict[str, Any]]]:
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    with open(f"{_targets_path()}.lock", "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        targets = _read_targets()
+        original = json.dumps(targets)
+        yield targets
+        if json.dumps(targets) != original:
+            tmp_path = f"{_targets_path()}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(targets, f)
+            os.replace(tmp_path, _targets_path())
+    _refresh(force=True)
+
+def _read_targets() -> List[Dict[str, Any]]:
+    try:
+        with open(_targets_path()) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+
+def _refresh(force: bool = False) -> None:
+    """Reload armed targets if the file changed; polled at most once a second."""
+    global _armed, _targets, _targets_mtime, _next_refresh
+    now = time.monotonic()
+    if not force and now < _next_refresh:
+        return
+    _next_refresh = now + 1.0
+    try:
+        mtime = os.stat(_targets_path()).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if force or mtime != _targets_mtime:
+        _targets_mtime = mtime
+        _targets = _read_targets() if mtime is not None else []
+        for target in _targets:
+            target["_pattern"] = re.compile(
+                "^" + re.sub(r"\\\{[^}]*\\\}", "[^/]+", re.escape(target["path"])) + "$"
+            )
+        _armed = bool(_targets)
+
+def arm(method: str, path: str, user_id: Optional[int], count: int,
+        interval_ms: Optional[float] = None) -> Dict[str, Any]:
+    """Profile the next count requests to method + path template (by user_id, if given)."""
+    target = {
+        "id": uuid.uuid4().hex[:12],
+        "method": method.upper(),
+        "path": path,
+        "user_id": user_id,
+        "remaining": count,
+        "interval_ms": interval_ms or settings.PROFILE_SAMPLE_INTERVAL_MS,
+        "armed_at": datetime.utcnow().isoformat(),
+    }
+    with _locked_targets() as targets:
+        targets.append(target)
+    return target
+
+def disarm(target_id: str) -> bool:
+    with _locked_targets() as targets:
+        remaining = [target for target in targets if target["id"] != target_id]
+        found = len(remaining) != len(targets)
+        targets[:] = remaining
+    return found
+
+def armed_targets() -> List[Dict[str, Any]]:
+    return _read_targets()
+
+def list_profiles() -> List[Dict[str, Any]]:
+    if not os.path.isdir(settings.PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(settings.PROFILE_DIR), reverse=True):
+        if filename.endswith(".json") and filename != TARGETS_FILE:
+            with open(os.path.join(settings.PROFILE_DIR, filename)) as f:
+                summary = json.load(f)
+            profiles.append({"name": filename[:-len(".json")], **{
+                key: summary[key] for key in ("method", "path", "user_id", "started_at", "duration_ms", "samples")
+            }})
+    return profiles
+
+def profile_path(name: str) -> Optional[str]:
+    if not re.match(r"^[A-Za-z0-9-]+$", name):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, f"{name}.folded")
+    return path if os.path.isfile(path) else None
+
+def _claim(method: str, path: str, scope: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+    matching = [target for target in _targets if target["method"] == method and target["_pattern"].match(path)]
+    if not matching:
+        return None, None
+    user_id = _token_user_id(scope)
+    candidates = [target["id"] for target in matching if target["user_id"] in (None, user_id)]
+    if not candidates:
+        return None, user_id
+    # Take one unit of the shared budget; another worker may have used it up
+    with _locked_targets() as targets:
+        for target in targets:
+            if target["id"] in candidates and target["remaining"] > 0:
+                target["remaining"] -= 1
+                claimed = dict(target)
+                targets[:] = [t for t in targets if t["remaining"] > 0]
+                return claimed, user_id
+    return None, user_id
+
+def _token_user_id(scope: Dict[str, Any]) -> Optional[int]:
+    from jose import jwt
+    from app.core.security import ALGORITHM
+    
+    authorization = dict(scope.get("headers", [])).get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return int(jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])["sub"])
+    except Exception:
+        return None
+
+def stage(timer: ContextManager[None], name: str, **labels: Any) -> ContextManager[None]:
+    """
+    Wrap a stage timer so an active profile samples this thread and labels
+    its samples with the stage. Without an active profile, returns timer.
+    """
+    if not (_armed or _sessions):
+        return timer
+    session = _current.get()
+    if session is None:
+        return timer
+    return _profiled_stage(session, timer, name, labels)
+
+@contextmanager
+def _profiled_stage(session: ProfileSession, timer: ContextManager[None], name: str,
+                    labels: Dict[str, Any]) -> Iterator[None]:
+    stages = session.attach()
+    label = " ".join([f"[{name}]", *(f"{key}={value}" for key, value in labels.items())])
+    stages.append(label)
+    started = time.perf_counter()
+    try:
+        with timer:
+            yield
+    finally:
+        stages.pop()
+        session.detach()
+        session.annotations.append({
+            "stage": name, **labels, "duration_ms": (time.perf_counter() - started) * 1000
+        })
+
+def annotate(**fields: Any) -> None:
+    """Attach fields (recipe counts, feature counts, ...) to the active profile, if any."""
+    if not (_armed or _sessions):
+        return
+    session = _current.get()
+    if session is not None:
+        session.annotations.append(fields)
+
+def _profiled_call(call: Callable) -> Callable:
+    """Wrap an endpoint so an active profile samples the thread it runs on while it runs."""
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def profiled_async(*args: Any, **kwargs: Any) -> Any:
+            session = _current.get() if (_armed or _sessions) else None
+            if session is None:
+                return await call(*args, **kwargs)
+            session.attach()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                session.detach()
+        return profiled_async
+    
+    @functools.wraps(call)
+    def profiled(*args: Any, **kwargs: Any) -> Any:
+        # Sync endpoints run on a threadpool thread that copies the request's context
+        session = _current.get() if (_armed or _sessions) else None
+        if session is None:
+            return call(*args, **kwargs)
+        session.attach()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            session.detach()
+    return profiled
+
+def instrument_routes(app: Any) -> None:
+    """Wrap every API endpoint of app with _profiled_call; run once after routes are included."""
+    from fastapi.routing import APIRoute
+    
+    for route in app.routes:
+        # The request handler calls dependant.call at request time
+        if isinstance(route, APIRoute):
+            route.dependant.call = _profiled_call(route.dependant.call)
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware starting a ProfileSession for requests matching an
+    armed target. With nothing armed it only polls the targets file once
+    a second.
+    """
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        _refresh()
+        if not _armed:
+            await self.app(scope, receive, send)
+            return
+        
+        global _sessions
+        method, path = scope["method"], scope["path"]
+        target, user_id = _claim(method, path, scope)
+        if target is None:
+            await self.app(scope, receive, send)
+            return
+        
+        session = ProfileSession(target, method, path, user_id)
+        status_code = None
+        
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        token = _current.set(session)
+        _sessions += 1
+        session.start()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _sessions -= 1
+            _current.reset(token)
+            name = session.stop(status_code)
+            logger.info(f"Profiled {method} {path} for user {session.user_id}: {name}")
@@ -0,0 +1,757 @@
+# benchmarks/login_storm.py
+"""
+Measure latency of a cheap authenticated endpoint before and during a
+burst of /auth/login requests against a running server.
+
+    python benchmarks/login_storm.py --base-url http://localhost:8000/api/v1 \
+        --email user@example.com --password secret --concurrency 32
+"""
+import argparse
+import json
+import math
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, List
+
+def login(base_url: str, email: str, password: str) -> int:
+    data = urllib.parse.urlencode({"username": email, "password": password}).encode()
+    request = urllib.request.Request(f"{base_url}/auth/login", data=data, method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def get_token(base_url: str, email: str, password: str) -> str:
+    data = urllib.parse.urlencode({"username": email, "password": password}).encode()
+    with urllib.request.urlopen(f"{base_url}/auth/login", data=data) as response:
+        return json.loads(response.read())["access_token"]
+
+def probe(base_url: str, token: str, duration: float) -> List[float]:
+    """Call GET /users/me sequentially for duration seconds, returning latencies in ms."""
+    request = urllib.request.Request(
+        f"{base_url}/users/me", headers={"Authorization": f"Bearer {token}"}
+    )
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "p50_ms": statistics.median(ordered),
+        "p95_ms": ordered[math.ceil(len(ordered) * 0.95) - 1] if ordered else 0.0,
+        "max_ms": ordered[-1] if ordered else 0.0,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8000/api/v1")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    token = get_token(args.base_url, args.email, args.password)
+    baseline = probe(args.base_url, token, args.duration)
+
+    stop = threading.Event()
+    statuses: Dict[int, int] = {}
+    lock = threading.Lock()
+
+    def storm() -> None:
+        while not stop.is_set():
+            code = login(args.base_url, args.email, args.password)
+            with lock:
+                statuses[code] = statuses.get(code, 0) + 1
+
+    threads = [threading.Thread(target=storm, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    during = probe(args.base_url, token, args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(json.dumps({
+        "baseline": summarize(baseline),
+        "during_login_storm": summarize(during),
+        "login_statuses": statuses,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
+
+# benchmarks/import_time.py
+"""
+Report `python -X importtime` for the API entry point and fail when the
+cold-start import chain pulls in the ML stack or exceeds a time budget.
+
+    python benchmarks/import_time.py --budget-ms 1500
+"""
+import argparse
+import json
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+HEAVY_MODULES = ("sklearn", "pandas", "joblib", "scipy")
+
+def measure(target: str) -> List[Tuple[str, int]]:
+    """Return (module, cumulative microseconds) for every import made by target."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Keep the nesting indentation; top-level imports have none
+        rows.append((name[1:].rstrip(), int(cumulative_us)))
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--target", default="app.main")
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    rows = measure(args.target)
+    top_level = [(name, us) for name, us in rows if not name.startswith(" ")]
+    total_ms = sum(us for _, us in top_level) / 1000
+    heavy = sorted({name.strip().split(".")[0] for name, _ in rows} & set(HEAVY_MODULES))
+    slowest: Dict[str, float] = {
+        name.strip(): us / 1000
+        for name, us in sorted(rows, key=lambda row: row[1], reverse=True)[:args.top]
+    }
+
+    print(json.dumps({
+        "target": args.target,
+        "total_ms": round(total_ms, 1),
+        "heavy_modules_imported": heavy,
+        "slowest_ms": slowest,
+    }, indent=2))
+
+    failed = False
+    if heavy:
+        print(f"FAIL: {args.target} eagerly imports {', '.join(heavy)}", file=sys.stderr)
+        failed = True
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"FAIL: import took {total_ms:.0f}ms, budget {args.budget_ms:.0f}ms", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
+
+# benchmarks/common.py
+"""
+Timing and result-file helpers shared by the benchmark suites.
+"""
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+def time_call(fn: Callable[[], Any], repeat: int = 20, warmup: int = 1,
+              setup: Optional[Callable[[], Any]] = None) -> Dict[str, float]:
+    """
+    Run fn warmup + repeat times and summarize the timed runs in ms.
+    setup, if given, runs untimed before every call.
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+    
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "median_ms": statistics.median(ordered),
+        "p95_ms": ordered[math.ceil(len(ordered) * 0.95) - 1],
+        "min_ms": ordered[0],
+        "max_ms": ordered[-1],
+    }
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def write_results(path: str, suite: str, params: Dict[str, Any], results: Dict[str, Dict[str, float]]) -> None:
+    """Write a suite's results with enough context to compare runs later."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    payload = {
+        "suite": suite,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    print(f"Results written to {path}", file=sys.stderr)
+
+# benchmarks/synthetic.py
+"""
+Seeded synthetic users, meals, ingredients and rated recipes.
+
+Ingredient popularity follows a Zipf-like law, each meal draws on its own
+palette of popular ingredients, and ratings come from a hidden per-meal
+response to quantities plus noise, so models have real signal to find.
+"""
+from typing import Any, Dict, List
+
+import numpy as np
+
+UNITS = ("g", "ml", "tsp", "tbsp", "cup", "unit(s)")
+
+def generate(
+    seed: int = 0,
+    users: int = 3,
+    meals_per_user: int = 4,
+    recipes_per_meal: int = 40,
+    vocabulary: int = 300,
+    ingredients_per_recipe: int = 8,
+    popularity_exponent: float = 1.1,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Build a dataset with sequential ids matching insertion order."""
+    rng = np.random.RandomState(seed)
+    
+    ingredients = [
+        {
+            "id": i + 1,
+            "name": f"ingredient-{i + 1}",
+            "unit": UNITS[rng.randint(len(UNITS))],
+            "typical_quantity": float(np.round(rng.lognormal(3.0, 1.0), 1)) or 1.0,
+        }
+        for i in range(vocabulary)
+    ]
+    popularity = 1.0 / np.arange(1, vocabulary + 1) ** popularity_exponent
+    popularity /= popularity.sum()
+    
+    dataset: Dict[str, List[Dict[str, Any]]] = {
+        "users": [], "ingredients": ingredients, "meals": [], "recipes": []
+    }
+    for u in range(users):
+        user_id = u + 1
+        dataset["users"].append({
+            "id": user_id,
+            "email": f"bench{user_id}@example.com",
+            "username": f"bench{user_id}",
+            "password": f"bench-password-{user_id}",
+        })
+        for _ in range(meals_per_user):
+            meal_id = len(dataset["meals"]) + 1
+            dataset["meals"].append({"id": meal_id, "user_id": user_id, "name": f"meal-{meal_id}"})
+            
+            palette_size = min(vocabulary, ingredients_per_recipe * 3)
+            palette = rng.choice(vocabulary, size=palette_size, replace=False, p=popularity)
+            palette_weights = popularity[palette] / popularity[palette].sum()
+            response = rng.normal(0, 1.0, size=palette_size)
+            base_rating = rng.uniform(4, 7)
+            
+            for _ in range(recipes_per_meal):
+                count = min(palette_size, max(2, rng.poisson(ingredients_per_recipe)))
+                chosen = rng.choice(palette_size, size=count, replace=False, p=palette_weights)
+                scale = rng.lognormal(0, 0.3, size=count)
+                rating = base_rating + float(response[chosen] @ np.log(scale)) + rng.normal(0, 0.3)
+                recipe_ingredients = []
+                for slot, factor in zip(chosen, scale):
+                    ingredient = ingredients[palette[slot]]
+                    recipe_ingredients.append({
+                        "ingredient_id": ingredient["id"],
+                        "ingredient_name": ingredient["name"],
+                        "quantity": round(ingredient["typical_quantity"] * float(factor), 2),
+                        "unit": ingredient["unit"],
+                    })
+                dataset["recipes"].append({
+                    "id": len(dataset["recipes"]) + 1,
+                    "meal_id": meal_id,
+                    "rating": round(min(10.0, max(1.0, rating)), 1),
+                    "ingredients": recipe_ingredients,
+                })
+    return dataset
+
+def recipes_for_meal(dataset: Dict[str, List[Dict[str, Any]]], meal_id: int) -> List[Dict[str, Any]]:
+    """A meal's recipes in the format RecipeOptimizer trains on."""
+    return [recipe for recipe in dataset["recipes"] if recipe["meal_id"] == meal_id]
+
+def populate(db: Any, dataset: Dict[str, List[Dict[str, Any]]], hash_password: Any) -> None:
+    """Insert a dataset into an empty database through the ORM models."""
+    from app.models.ingredient import Ingredient
+    from app.models.meal import Meal
+    from app.models.recipe import Recipe, RecipeIngredient
+    from app.models.user import User
+    
+    db.add_all([
+        User(id=user["id"], email=user["email"], username=user["username"],
+             hashed_password=hash_password(user["password"]))
+        for user in dataset["users"]
+    ])
+    db.add_all([
+        Ingredient(id=ingredient["id"], name=ingredient["name"], user_id=1, is_public=True)
+        for ingredient in dataset["ingredients"]
+    ])
+    db.add_all([
+        Meal(id=meal["id"], user_id=meal["user_id"], name=meal["name"])
+        for meal in dataset["meals"]
+    ])
+    db.flush()
+    for recipe in dataset["recipes"]:
+        db.add(Recipe(id=recipe["id"], meal_id=recipe["meal_id"], rating=recipe["rating"]))
+        db.add_all([
+            RecipeIngredient(recipe_id=recipe["id"], ingredient_id=ri["ingredient_id"],
+                             quantity=ri["quantity"], unit=ri["unit"])
+            for ri in recipe["ingredients"]
+        ])
+    db.commit()
+
+# benchmarks/micro_ml.py
+"""
+Micro-benchmarks for RecipeOptimizer on a synthetic meal.
+
+    python -m benchmarks.micro_ml --recipes 200 --output benchmark-results/micro.json
+
+Exits non-zero if a precomputed optimization disagrees with the live one.
+"""
+import argparse
+import math
+import os
+import sys
+import tempfile
+
+from benchmarks.common import time_call, write_results
+from benchmarks.synthetic import generate, recipes_for_meal
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recipes", type=int, default=120)
+    parser.add_argument("--vocabulary", type=int, default=300)
+    parser.add_argument("--model-types", default="linear,ridge,lasso,random_forest,gradient_boosting,svr")
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--train-repeat", type=int, default=3)
+    parser.add_argument("--output", default="benchmark-results/micro_ml.json")
+    args = parser.parse_args()
+    
+    model_dir = tempfile.mkdtemp(prefix="bench-models-")
+    os.environ.setdefault("PREDICTION_CACHE_PATH", os.path.join(model_dir, "prediction_cache.sqlite3"))
+    
+    from app.ml import materialized
+    from app.ml.feature_store import MealFeatures
+    from app.ml.models import RecipeOptimizer
+    
+    dataset = generate(seed=args.seed, users=1, meals_per_user=1,
+                       recipes_per_meal=args.recipes, vocabulary=args.vocabulary)
+    recipes = recipes_for_meal(dataset, 1)
+    features = MealFeatures.from_recipes_data(recipes)
+    sample = recipes[0]["ingredients"]
+    
+    results = {}
+    mismatches = []
+    optimizer = RecipeOptimizer(model_type="linear", model_dir=model_dir)
+    results["prepare_data/list"] = time_call(lambda: optimizer._prepare_data(recipes), args.repeat)
+    results["prepare_data/feature_store"] = time_call(lambda: optimizer._prepare_data(features), args.repeat)
+    results["analyze_ingredient_influence"] = time_call(
+        lambda: optimizer.analyze_ingredient_influence(features), args.repeat
+    )
+    
+    for model_type in [m.strip() for m in args.model_types.split(",") if m.strip()]:
+        optimizer = RecipeOptimizer(model_type=model_type, model_dir=model_dir)
+        results[f"train/{model_type}"] = time_call(
+            lambda: optimizer.train(features, 1, 1), args.train_repeat, warmup=0
+        )
+        loaded = RecipeOptimizer(model_type=model_type, model_dir=model_dir)
+        results[f"load/{model_type}"] = time_call(lambda: loaded.load(1, 1), args.repeat)
+        results[f"predict/{model_type}"] = time_call(lambda: loaded.predict(sample), args.repeat)
+        results[f"optimize_recipe/{model_type}"] = time_call(lambda: loaded.optimize_recipe(sample), args.repeat)
+        # The trained optimizer carries its artifact version, so it goes
+        # through the prediction cache (warm after the first call)
+        results[f"optimize_recipe_cached/{model_type}"] = time_call(
+            lambda: optimizer.optimize_recipe(sample), args.repeat
+        )
+        results[f"response_curves/{model_type}"] = time_call(
+            lambda: loaded.response_curves(sample, points=50), args.repeat
+        )
+        
+        # Precomputed results must report what a live optimization would
+        materialized.precompute_optimizations(materialized.snapshot(optimizer), 1, 1, None, recipes[:1], 1)
+        stored = materialized.get_materialized_optimization(
+            optimizer, 1, 1, recipes[0]["id"], None, materialized.get_recipe_version(sample)
+        )
+        _, _, live_confidence, live_uncertainty = optimizer.optimize_recipe(sample)
+        if stored is None or not math.isclose(stored["confidence"], live_confidence) or not (
+            math.isclose(stored["uncertainty"], live_uncertainty)
+            or math.isnan(stored["uncertainty"]) and math.isnan(live_uncertainty)
+        ):
+            mismatches.append(model_type)
+        
+        results[f"artifact_bytes/{model_type}"] = {
+            "bytes": os.path.getsize(loaded._get_model_path(1, 1))
+        }
+    
+    write_results(args.output, "micro_ml", vars(args), results)
+    
+    if mismatches:
+        print(f"FAIL: precomputed and live optimizations differ for {', '.join(mismatches)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+# benchmarks/macro_api.py
+"""
+Macro-benchmarks driving the FastAPI app in-process (fastapi.testclient,
+which needs httpx) against a throwaway SQLite database seeded with
+synthetic data.
+
+    python -m benchmarks.macro_api --output benchmark-results/macro.json
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from typing import Any, Callable, Dict, Iterator
+
+from benchmarks.common import time_call, write_results
+from benchmarks.synthetic import generate
+
+def configure(workdir: str) -> None:
+    """Point settings at workdir; must run before anything imports app."""
+    os.environ.update({
+        "DATABASE_URI": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "CREATE_TABLES_ON_STARTUP": "true",
+        "ML_PREWARM_ON_STARTUP": "false",
+        "SHARE_SWEEP_INTERVAL_SECONDS": "0",
+        "BCRYPT_ROUNDS": "4",
+        "PASSWORD_HASH_WORKERS": "0",
+        "FEATURE_STORE_DIR": os.path.join(workdir, "feature_store"),
+    })
+    # Model artifacts go to ./models
+    os.chdir(workdir)
+
+def chunked_upload(size: int, boundary: str = "bench-boundary") -> Iterator[bytes]:
+    """Multipart profile-image body of about size bytes, sent without a content-length."""
+    yield (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="big.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode()
+    chunk = b"\0" * (64 * 1024)
+    for _ in range(size // len(chunk) + 1):
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--meals", type=int, default=4)
+    parser.add_argument("--recipes-per-meal", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--output", default="benchmark-results/macro_api.json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    
+    workdir = tempfile.mkdtemp(prefix="bench-api-")
+    configure(workdir)
+    
+    from fastapi.testclient import TestClient
+    from app.core.config import settings
+    from app.core.security import get_password_hash
+    from app.db.session import SessionLocal
+    from app.main import app
+    from benchmarks.synthetic import populate
+    
+    dataset = generate(seed=args.seed, users=1, meals_per_user=args.meals,
+                       recipes_per_meal=args.recipes_per_meal)
+    api = settings.API_V1_STR
+    results: Dict[str, Dict[str, float]] = {}
+    
+    try:
+        with TestClient(app) as client:
+            db = SessionLocal()
+            try:
+                populate(db, dataset, get_password_hash)
+            finally:
+                db.close()
+            
+            user = dataset["users"][0]
+            token = client.post(
+                f"{api}/auth/login", data={"username": user["email"], "password": user["password"]}
+            ).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            meal_id = dataset["meals"][0]["id"]
+            recipe = next(r for r in dataset["recipes"] if r["meal_id"] == meal_id)
+            new_recipe = {
+                "meal_id": meal_id,
+                "rating": 7.0,
+                "ingredients": [
+                    {k: ri[k] for k in ("ingredient_id", "quantity", "unit")} for ri in recipe["ingredients"]
+                ],
+            }
+            
+            def call(method: str, path: str, **kwargs: Any) -> Callable[[], None]:
+                def run() -> None:
+                    response = client.request(method, f"{api}{path}", headers=headers, **kwargs)
+                    if response.status_code >= 400:
+                        raise RuntimeError(f"{method} {path} -> {response.status_code}: {response.text}")
+                return run
+            
+            scenarios = {
+                "GET /users/me": call("GET", "/users/me"),
+                "GET /meals": call("GET", "/meals"),
+                "GET /meals/{id}": call("GET", f"/meals/{meal_id}"),
+                "GET /recipes/meal/{id}": call("GET", f"/recipes/meal/{meal_id}"),
+                "GET /recipes/{id}": call("GET", f"/recipes/{recipe['id']}"),
+                "POST /recipes": call("POST", "/recipes", json=new_recipe),
+                "GET /ingredients": call("GET", "/ingredients"),
+            }
+            for name, run in scenarios.items():
+                results[name] = time_call(run, args.repeat)
+            
+            # First ML call per meal trains its model; later calls reuse it
+            other_meals = [meal["id"] for meal in dataset["meals"][1:]]
+            if other_meals:
+                cold = iter(other_meals)
+                results["POST /ml/train/{id} (cold)"] = time_call(
+                    lambda: call("POST", f"/ml/train/{next(cold)}")(), len(other_meals), warmup=0
+                )
+            ml_scenarios = {
+                "POST /ml/optimize-recipe/{id}": call("POST", f"/ml/optimize-recipe/{recipe['id']}"),
+                "POST /ml/predict-rating": call(
+                    "POST", f"/ml/predict-rating?meal_id={meal_id}",
+                    json=[{"id": 0, "recipe_id": recipe["id"], **ri} for ri in new_recipe["ingredients"]]
+                ),
+                "GET /ml/analyze-ingredients/{id}": call("GET", f"/ml/analyze-ingredients/{meal_id}"),
+                "GET /ml/similar-recipes/{id}": call("GET", f"/ml/similar-recipes/{recipe['id']}"),
+                "GET /ml/suggestions/{id}": call("GET", f"/ml/suggestions/{meal_id}"),
+            }
+            for name, run in ml_scenarios.items():
+                results[name] = time_call(run, max(3, args.repeat // 5))
+            
+            # A chunked upload must be cut off with 413 once it passes the limit
+            oversize = client.post(
+                f"{api}/users/profile-image",
+                headers={**headers, "Content-Type": "multipart/form-data; boundary=bench-boundary"},
+                content=chunked_upload(settings.PROFILE_IMAGE_MAX_BYTES + 128 * 1024),
+            ).status_code
+    finally:
+        os.chdir(os.path.dirname(output) or "/")
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    write_results(output, "macro_api", vars(args), results)
+    if oversize != 413:
+        print(f"FAIL: oversize chunked upload answered {oversize}, expected 413", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
+
+# benchmarks/serialization.py
+"""
+Serialization benchmark for the large list endpoints: the ORM + pydantic +
+jsonable_encoder path FastAPI takes for response_model, against the
+column-row builders and app.core.serialization, at several page sizes.
+
+    python -m benchmarks.serialization --output benchmark-results/serialization.json
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict
+
+from benchmarks.common import time_call, write_results
+from benchmarks.macro_api import configure
+from benchmarks.synthetic import generate
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", default="benchmark-results/serialization.json")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    
+    workdir = tempfile.mkdtemp(prefix="bench-serialization-")
+    configure(workdir)
+    
+    from fastapi.encoders import jsonable_encoder
+    from app.core.security import get_password_hash
+    from app.core.serialization import dumps
+    from app.db.base import Base
+    from app.db.session import SessionLocal, engine
+    from app.models import (  # noqa: F401 - register every table
+        ingredient, meal, recipe, social_account, social_share, user
+    )
+    from app.schemas.ingredient import Ingredient as IngredientSchema
+    from app.schemas.recipe import Recipe as RecipeSchema
+    from app.services import ingredient as ingredient_service
+    from app.services import recipe as recipe_service
+    from benchmarks.synthetic import populate
+    
+    # One meal holding the largest page, and a vocabulary as large as it
+    largest = max(sizes)
+    dataset = generate(seed=args.seed, users=1, meals_per_user=1,
+                       recipes_per_meal=largest, vocabulary=largest)
+    results: Dict[str, Dict[str, float]] = {}
+    
+    try:
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        try:
+            populate(db, dataset, get_password_hash)
+            
+            for size in sizes:
+                def recipes_orm() -> bytes:
+                    db.expunge_all()
+                    recipes = recipe_service.get_recipes_by_meal(db, meal_id=1, limit=size)
+                    content = jsonable_encoder([RecipeSchema.from_orm(r) for r in recipes])
+                    return json.dumps(content, ensure_ascii=False, allow_nan=False,
+                                      separators=(",", ":")).encode("utf-8")
+                
+                def recipes_rows() -> bytes:
+                    return dumps(recipe_service.get_recipe_rows_by_meal(db, meal_id=1, limit=size))
+                
+                def ingredients_orm() -> bytes:
+                    db.expunge_all()
+                    ingredients = ingredient_service.get_ingredients(db, user_id=1, limit=size)
+                    content = jsonable_encoder([IngredientSchema.from_orm(i) for i in ingredients])
+                    return json.dumps(content, ensure_ascii=False, allow_nan=False,
+                                      separators=(",", ":")).encode("utf-8")
+                
+                def ingredients_rows() -> bytes:
+                    return dumps(ingredient_service.get_ingredient_rows(db, user_id=1, limit=size))
+                
+                # Both paths must put the same document on the wire
+                for name, orm_path, rows_path in (
+                    ("recipes", recipes_orm, recipes_rows),
+                    ("ingredients", ingredients_orm, ingredients_rows),
+                ):
+                    body = rows_path()
+                    if json.loads(orm_path()) != json.loads(body):
+                        raise RuntimeError(f"{name}: row output differs from response_model output")
+                    results[f"{name} n={size} orm"] = time_call(orm_path, args.repeat)
+                    results[f"{name} n={size} rows"] = time_call(rows_path, args.repeat)
+                    results[f"{name} n={size} rows+gzip"] = time_call(
+                        lambda: gzip.compress(rows_path(), compresslevel=5), args.repeat
+                    )
+                    results[f"{name} n={size} rows+gzip"]["bytes"] = len(gzip.compress(body, compresslevel=5))
+                    results[f"{name} n={size} rows"]["bytes"] = len(body)
+        finally:
+            db.close()
+    finally:
+        engine.dispose()
+        os.chdir(os.path.dirname(output) or "/")
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    write_results(output, "serialization", vars(args), results)
+
+if __name__ == "__main__":
+    main()
+
+# benchmarks/compare.py
+"""
+Compare two benchmark result files and fail on regressions.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.10
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+# Metrics compared per benchmark, in order of preference
+COMPARED = ("median_ms", "bytes")
+
+def _metric(entry: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+    for name in COMPARED:
+        if name in entry:
+            return name, float(entry[name])
+    return None
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="Ignore absolute timing changes smaller than this")
+    args = parser.parse_args()
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+    
+    regressions = []
+    print(f"{'benchmark':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            print(f"{name:<45} {'(only in ' + ('current' if name in current else 'baseline') + ')':>34}")
+            continue
+        before, after = _metric(baseline[name]), _metric(current[name])
+        if before is None or after is None or before[0] != after[0]:
+            continue
+        metric, old = before
+        new = after[1]
+        change = (new - old) / old if old else 0.0
+        regressed = change > args.threshold and not (
+            metric == "median_ms" and new - old < args.min_delta_ms
+        )
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<45} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{flag}")
+        if regressed:
+            regressions.append(name)
+    
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}",
+              file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
 # app/main.py
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse
 
 from app.api.router import api_router
+from app.core import metrics, profiling
 from app.core.config import settings
+from app.core.uploads import BodySizeLimitMiddleware
 from app.db.base import Base
 from app.db.session import engine
-
-# Create database tables
-Base.metadata.create_all(bind=engine)
+from app.db.instrumentation import QueryStatsMiddleware
+from app.ml import loader as ml_loader
+from app.ml import metrics as ml_metrics  # noqa: F401 - registers ML metric families
+from app.services import catalog as ingredient_catalog
+from app.services import maintenance
 
 # Create FastAPI app
 app = FastAPI(
@@ -29,9 +33,48 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+# Count SQL statements and DB time per request
+if settings.DB_QUERY_STATS_ENABLED:
+    app.add_middleware(QueryStatsMiddleware)
+
+# Sample requests that a superuser armed a profile for
+if settings.PROFILING_ENABLED:
+    app.add_middleware(profiling.ProfilingMiddleware)
+
+# Refuse oversize uploads before they are parsed; the multipart envelope
+# gets a little headroom over the image limit itself
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={f"{settings.API_V1_STR}/users/profile-image": settings.PROFILE_IMAGE_MAX_BYTES + 64 * 1024},
+)
+
 # Include API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+# Let a running profile sample the thread each endpoint runs on
+if settings.PROFILING_ENABLED:
+    profiling.instrument_routes(app)
+
+@app.on_event("startup")
+def on_startup() -> None:
+    # Create database tables (gunicorn's master has already done so)
+    if settings.CREATE_TABLES_ON_STARTUP:
+        Base.metadata.create_all(bind=engine)
+    
+    # Bulk-load ingredient names, owners and public flags
+    ingredient_catalog.get_catalog()
+    
+    # Import sklearn/pandas off the request path once CRUD is serving
+    if settings.ML_PREWARM_ON_STARTUP:
+        ml_loader.warm_in_background()
+    
+    # Periodically delete expired share links, in one worker at a time
+    maintenance.start_background_maintenance()
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    maintenance.stop_background_maintenance()
+
 @app.get("/", include_in_schema=False)
 def root() -> RedirectResponse:
     """
@@ -39,6 +82,94 @@ def root() -> RedirectResponse:
     """
     return RedirectResponse(url=f"{settings.API_V1_STR}/docs")
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics() -> PlainTextResponse:
+    """
+    Metrics in the Prometheus text exposition format.
+    """
+    if not settings.METRICS_ENABLED:
+        return PlainTextResponse("Not Found", status_code=404)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+
+# gunicorn.conf.py
+"""
+Prefork production serving: gunicorn forks uvicorn workers from a master
+that has already imported the app and created the tables (when
+CREATE_TABLES_ON_STARTUP is set). With ML_PRELOAD_IN_MASTER the master
+also imports the ML stack and the most used models, so workers share that
+memory copy-on-write; otherwise each worker loads them in the background
+after it starts serving, keeping them off the cold-start path.
+
+    gunicorn app.main:app -c gunicorn.conf.py
+
+`kill -HUP <master pid>` reloads gracefully: the master preloads the
+current hot models again (when enabled), starts fresh workers, and only
+then stops the old ones once they finish their in-flight requests.
+"""
+import gc
+import logging
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+logger = logging.getLogger("gunicorn.error")
+
+def _preload_models() -> None:
+    from app.core.config import settings
+    if not settings.ML_PRELOAD_IN_MASTER:
+        return
+    
+    from app.ml import loader as ml_loader
+    from app.ml import registry as model_registry
+    
+    # Imports sklearn/pandas/joblib once, in the master
+    ml_loader.training()
+    from app.ml.models import preload_hot_models
+    
+    model_registry.clear()
+    loaded = preload_hot_models()
+    # Keep the collector from touching (and so copying) inherited objects
+    gc.collect()
+    gc.freeze()
+    logger.info(f"Preloaded {loaded} models for workers")
+
+def _create_tables() -> None:
+    from app.core.config import settings
+    if not settings.CREATE_TABLES_ON_STARTUP:
+        return
+    
+    from app.db.base import Base
+    from app.db.session import engine
+    
+    Base.metadata.create_all(bind=engine)
+    # Workers inherit the preloaded settings, so they skip this at startup
+    settings.CREATE_TABLES_ON_STARTUP = False
+
+def when_ready(server) -> None:
+    _create_tables()
+    _preload_models()
+
+def on_reload(server) -> None:
+    # Runs before the replacement workers are forked
+    gc.unfreeze()
+    _preload_models()
+
+def post_fork(server, worker) -> None:
+    # Connections opened in the master must not be shared with workers
+    from app.db.session import engine
+    engine.dispose(close=False)
+
+def worker_exit(server, worker) -> None:
+    from app.ml import registry as model_registry
+    model_registry.flush_access_stats()
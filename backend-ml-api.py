@@ -1,37 +1,63 @@
 # app/api/endpoints/ml.py
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Any, Generator, List, Optional
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from app.api import dependencies
+from app.core.concurrency import AdmissionController
+from app.core.config import settings
 from app.core.security import get_current_user
-from app.ml import training, prediction
-from app.schemas.ml import IngredientInfluence, RecipeSuggestion
+from app.ml import loader as ml_loader
+from app.ml import similarity
+from app.schemas.ml import IngredientInfluence, ModelType, RecipeSuggestion, ResponseCurveRequest
 from app.schemas.recipe import RecipeIngredient, RecipeCreate
 from app.services import recipe as recipe_service
+from app.models.meal import Meal
 from app.models.user import User
 
 router = APIRouter()
 
+# Keeps bursts of ML work from starving CRUD requests of worker threads
+ml_admission = AdmissionController(
+    max_concurrent=settings.ML_MAX_CONCURRENT_REQUESTS,
+    max_per_key=settings.ML_MAX_CONCURRENT_REQUESTS_PER_USER,
+    max_queue=settings.ML_MAX_QUEUED_REQUESTS,
+    queue_timeout=settings.ML_QUEUE_TIMEOUT_SECONDS,
+)
+
+def admit_ml_request(current_user: User = Depends(get_current_user)) -> Generator:
+    """
+    Dependency holding an ML admission slot for the whole request,
+    including a streamed response. Rejects with 429 when the user is over
+    their limit and 503 when the queue is full or the wait times out.
+    """
+    ml_admission.acquire(current_user.id)
+    try:
+        yield current_user
+    finally:
+        ml_admission.release(current_user.id)
+
 @router.post("/train/{meal_id}", response_model=dict)
 def train_model(
     meal_id: int,
-    model_type: str = "random_forest",
-    current_user: User = Depends(get_current_user),
+    model_type: Optional[ModelType] = None,
+    current_user: User = Depends(admit_ml_request),
     db: Session = Depends(dependencies.get_db)
 ) -> Any:
     """
     Train a ML model for a specific meal.
+    Use model_type=auto to evaluate every model type and keep the best one.
+    Without a model_type, a meal with few recipes uses the user's pooled model.
     """
     # Verify meal belongs to current user
-    meal = db.query("Meal").filter(id=meal_id, user_id=current_user.id).first()
-    if not meal:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Meal not found or doesn't belong to current user"
-        )
+    dependencies.verify_ownership(db, Meal, meal_id, current_user, "Meal not found")
     
-    result = training.train_model_for_meal(meal_id, current_user.id, model_type)
+    result = ml_loader.training().train_model_for_meal(
+        meal_id, current_user.id, model_type.value if model_type else None
+    )
     
     if not result["success"]:
         raise HTTPException(
@@ -44,13 +70,17 @@ def train_model(
 @router.post("/optimize-recipe/{recipe_id}", response_model=dict)
 def optimize_recipe(
     recipe_id: int,
-    model_type: str = "random_forest",
-    current_user: User = Depends(get_current_user)
+    model_type: Optional[ModelType] = None,
+    uncertainty_penalty: float = Query(0.0, ge=0.0),
+    current_user: User = Depends(admit_ml_request)
 ) -> Any:
     """
     Optimize a recipe by adjusting ingredient quantities.
+    A positive uncertainty_penalty favours adjustments the model is more certain about.
     """
-    result = prediction.optimize_recipe(recipe_id, current_user.id, model_type)
+    result = ml_loader.prediction().optimize_recipe(
+        recipe_id, current_user.id, model_type.value if model_type else None, uncertainty_penalty
+    )
     
     if not result["success"]:
         raise HTTPException(
@@ -60,6 +90,79 @@ def optimize_recipe(
     
     return result
 
+@router.get("/similar-recipes/{recipe_id}", response_model=dict)
+def get_similar_recipes(
+    recipe_id: int,
+    k: int = Query(5, ge=1, le=50),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(dependencies.get_db)
+) -> Any:
+    """
+    Get the recipes of the same meal closest to a recipe by ingredient quantities.
+    """
+    recipe, owner_id = recipe_service.get_recipe_with_owner(db, recipe_id=recipe_id)
+    if not recipe:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Recipe not found"
+        )
+    if owner_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    
+    index = similarity.get_index(db, recipe.meal_id)
+    neighbors = index.neighbors_of(recipe_id, k=k)
+    
+    return {
+        "success": True,
+        "recipe_id": recipe_id,
+        "neighbors": [
+            {"recipe_id": neighbor_id, "similarity": score, "rating": rating}
+            for neighbor_id, score, rating in neighbors
+        ]
+    }
+
+@router.get("/suggestions/{meal_id}", response_model=List[RecipeSuggestion])
+def suggest_recipes(
+    meal_id: int,
+    k: int = Query(5, ge=1, le=50),
+    model_type: Optional[ModelType] = None,
+    uncertainty_penalty: float = Query(0.0, ge=0.0),
+    stream: bool = False,
+    current_user: User = Depends(admit_ml_request),
+    db: Session = Depends(dependencies.get_db)
+) -> Any:
+    """
+    Suggest new recipes for a meal by recombining ingredients from its history.
+    With stream=true, progress is sent as newline-delimited JSON snapshots.
+    """
+    dependencies.verify_ownership(db, Meal, meal_id, current_user, "Meal not found")
+    
+    result = ml_loader.prediction().suggest_recipes(
+        meal_id, current_user.id, model_type.value if model_type else None, k, uncertainty_penalty
+    )
+    
+    if not result["success"]:
+        raise HTTPException(
+            status_code=result.get("status_code", status.HTTP_400_BAD_REQUEST),
+            detail=result.get("error", "Failed to suggest recipes")
+        )
+    
+    if stream:
+        def ndjson() -> Any:
+            for snapshot in result["snapshots"]:
+                snapshot["suggestions"] = [RecipeSuggestion(**s) for s in snapshot["suggestions"]]
+                yield json.dumps(jsonable_encoder(snapshot)) + "\n"
+        
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    snapshot = None
+    for snapshot in result["snapshots"]:
+        pass
+    return snapshot["suggestions"]
+
 @router.post("/save-optimized-recipe", response_model=dict)
 def save_optimized_recipe(
     recipe: RecipeCreate,
@@ -89,13 +192,13 @@ def save_optimized_recipe(
 @router.get("/analyze-ingredients/{meal_id}", response_model=dict)
 def analyze_ingredient_influence(
     meal_id: int,
-    model_type: str = "linear",
-    current_user: User = Depends(get_current_user)
+    model_type: ModelType = ModelType.LINEAR,
+    current_user: User = Depends(admit_ml_request)
 ) -> Any:
     """
     Analyze the influence of each ingredient on the recipe rating.
     """
-    result = prediction.analyze_ingredient_influence(meal_id, current_user.id, model_type)
+    result = ml_loader.prediction().analyze_ingredient_influence(meal_id, current_user.id, model_type.value)
     
     if not result["success"]:
         raise HTTPException(
@@ -109,15 +212,17 @@ def analyze_ingredient_influence(
 def predict_recipe_rating(
     recipe_ingredients: List[RecipeIngredient],
     meal_id: int,
-    model_type: str = "random_forest",
-    current_user: User = Depends(get_current_user)
+    model_type: Optional[ModelType] = None,
+    current_user: User = Depends(admit_ml_request)
 ) -> Any:
     """
     Predict rating for a recipe based on its ingredients.
     """
     ingredients_data = [ingredient.dict() for ingredient in recipe_ingredients]
     
-    result = prediction.predict_recipe_rating(ingredients_data, current_user.id, meal_id, model_type)
+    result = ml_loader.prediction().predict_recipe_rating(
+        ingredients_data, current_user.id, meal_id, model_type.value if model_type else None
+    )
     
     if not result["success"]:
         raise HTTPException(
@@ -126,3 +231,37 @@ def predict_recipe_rating(
         )
     
     return result
+
+@router.post("/response-curves", response_model=dict)
+def get_response_curves(
+    curve_request: ResponseCurveRequest,
+    meal_id: int,
+    model_type: Optional[ModelType] = None,
+    current_user: User = Depends(admit_ml_request),
+    db: Session = Depends(dependencies.get_db)
+) -> Any:
+    """
+    Predicted rating as each ingredient's quantity, or a pair of quantities, varies.
+    Curves and interaction grids come back as arrays aligned with their quantities.
+    """
+    dependencies.verify_ownership(db, Meal, meal_id, current_user, "Meal not found")
+    
+    ingredients_data = [ingredient.dict() for ingredient in curve_request.ingredients]
+    
+    result = ml_loader.prediction().response_curves(
+        ingredients_data, current_user.id, meal_id, model_type.value if model_type else None,
+        ingredient_ids=curve_request.ingredient_ids,
+        interactions=curve_request.interactions,
+        points=curve_request.points,
+        grid_points=curve_request.grid_points,
+        min_scale=curve_request.min_scale,
+        max_scale=curve_request.max_scale
+    )
+    
+    if not result["success"]:
+        raise HTTPException(
+            status_code=result.get("status_code", status.HTTP_400_BAD_REQUEST),
+            detail=result.get("error", "Failed to compute response curves")
+        )
+    
+    return result
@@ -1,17 +1,722 @@
+# app/ml/loader.py
+import importlib
+import logging
+import threading
+import time
+from types import ModuleType
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# The ML stack (sklearn, pandas, joblib) dominates cold start, so nothing
+# outside app.ml imports it eagerly; endpoints resolve it through here.
+_lock = threading.Lock()
+_modules: Dict[str, ModuleType] = {}
+_state: Dict[str, Any] = {"warm": False, "loading": False, "error": None, "load_seconds": None}
+
+def _load() -> Dict[str, ModuleType]:
+    if _state["warm"]:
+        return _modules
+    with _lock:
+        if not _state["warm"]:
+            _state["loading"] = True
+            start = time.perf_counter()
+            try:
+                _modules["training"] = importlib.import_module("app.ml.training")
+                _modules["prediction"] = importlib.import_module("app.ml.prediction")
+            except Exception as e:
+                _state["error"] = str(e)
+                raise
+            finally:
+                _state["loading"] = False
+            _state["error"] = None
+            _state["load_seconds"] = time.perf_counter() - start
+            _state["warm"] = True
+            logger.info(f"ML stack loaded in {_state['load_seconds']:.2f}s")
+    return _modules
+
+def training() -> ModuleType:
+    return _load()["training"]
+
+def prediction() -> ModuleType:
+    return _load()["prediction"]
+
+def warm_in_background() -> Optional[threading.Thread]:
+    """
+    Import the ML stack and load the most used models on a daemon thread
+    so the first ML requests are fast. A no-op in workers forked from a
+    master that preloaded both.
+    """
+    if _state["warm"]:
+        return None
+    
+    def _warm() -> None:
+        try:
+            _load()
+            if settings.ML_PRELOAD_MODELS > 0:
+                from app.ml.models import preload_hot_models
+                start = time.perf_counter()
+                loaded = preload_hot_models()
+                logger.info(f"Preloaded {loaded} models in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Error pre-warming ML stack: {e}")
+    
+    thread = threading.Thread(target=_warm, name="ml-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+def status() -> Dict[str, Any]:
+    return dict(_state)
+
+# app/ml/metrics.py
+from typing import ContextManager
+
+from app.core import profiling
+from app.core.metrics import Counter, Histogram
+
+STAGE_SECONDS = Histogram(
+    "ml_stage_duration_seconds",
+    "Latency of ML pipeline stages.",
+    ["stage", "model_type"],
+)
+IMPLICIT_RETRAINS = Counter(
+    "ml_implicit_retrains_total",
+    "Models trained because no artifact matched the current data.",
+    ["model_type"],
+)
+MODEL_CACHE = Counter(
+    "ml_model_cache_total",
+    "Lookups of persisted models and precomputed results, by result (hit/miss).",
+    ["model_type", "cache", "result"],
+)
+ARTIFACT_BYTES_LOADED = Counter(
+    "ml_artifact_bytes_loaded_total",
+    "Bytes of model artifacts read from disk.",
+    ["model_type"],
+)
+CANDIDATES_EVALUATED = Counter(
+    "ml_candidates_evaluated_total",
+    "Candidate recipes scored by the model.",
+    ["model_type", "operation"],
+)
+
+def stage(name: str, model_type: str) -> ContextManager[None]:
+    """
+    Time a pipeline stage into ml_stage_duration_seconds; an active
+    request profile also labels its samples with the stage.
+    """
+    return profiling.stage(STAGE_SECONDS.labels(stage=name, model_type=model_type).time(),
+                           name, model_type=model_type)
+
+def cache_result(model_type: str, cache: str, hit: bool) -> None:
+    MODEL_CACHE.labels(model_type=model_type, cache=cache, result="hit" if hit else "miss").inc()
+
+# app/ml/feature_store.py
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import hashlib
+import os
+import threading
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.services import catalog
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX development machines
+    fcntl = None
+
+class MealFeatures:
+    """
+    Columnar snapshot of one meal's training data: a recipes x features
+    quantity matrix, the ratings vector, the feature keys
+    ("<ingredient_id>_<unit>") and ingredient names.
+    """
+    def __init__(self, recipe_ids: np.ndarray, ratings: np.ndarray, X: np.ndarray,
+                 keys: List[str], names: Dict[int, str], content_hash: Optional[str] = None):
+        self.recipe_ids = recipe_ids
+        self.ratings = ratings
+        self.X = X
+        self.keys = keys
+        self.names = names
+        self.content_hash = content_hash or self._hash()
+    
+    @classmethod
+    def empty(cls) -> "MealFeatures":
+        return cls(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros((0, 0)), [], {})
+    
+    @classmethod
+    def from_recipes_data(cls, recipes_data: List[Dict[str, Any]]) -> "MealFeatures":
+        features = cls.empty()
+        for recipe in recipes_data:
+            features.upsert(recipe["id"], recipe["rating"], recipe["ingredients"], rehash=False)
+        features.content_hash = features._hash()
+        return features
+    
+    def _hash(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.recipe_ids.tobytes())
+        digest.update(self.ratings.tobytes())
+        digest.update(np.ascontiguousarray(self.X).tobytes())
+        digest.update("\x00".join(self.keys).encode("utf-8"))
+        return digest.hexdigest()
+    
+    def __len__(self) -> int:
+        return len(self.recipe_ids)
+    
+    def name(self, ingredient_id: int) -> str:
+        """Current name from the ingredient catalog, else the one stored with the features."""
+        ingredient_catalog = catalog.peek()
+        if ingredient_catalog is not None and ingredient_id in ingredient_catalog:
+            return ingredient_catalog.name(ingredient_id)
+        return self.names.get(ingredient_id, "Unknown")
+    
+    def _row_index(self, recipe_id: int) -> Optional[int]:
+        matches = np.flatnonzero(self.recipe_ids == recipe_id)
+        return int(matches[0]) if len(matches) else None
+    
+    def upsert(self, recipe_id: int, rating: float, ingredients: List[Dict[str, Any]],
+               rehash: bool = True) -> None:
+        columns = {key: i for i, key in enumerate(self.keys)}
+        for ingredient in ingredients:
+            key = f"{ingredient['ingredient_id']}_{ingredient['unit']}"
+            if key not in columns:
+                columns[key] = len(self.keys)
+                self.keys.append(key)
+            if ingredient.get("ingredient_name"):
+                self.names[int(ingredient["ingredient_id"])] = ingredient["ingredient_name"]
+        if len(self.keys) > self.X.shape[1]:
+            self.X = np.hstack([self.X, np.zeros((self.X.shape[0], len(self.keys) - self.X.shape[1]))])
+        
+        row = np.zeros(len(self.keys))
+        for ingredient in ingredients:
+            row[columns[f"{ingredient['ingredient_id']}_{ingredient['unit']}"]] = ingredient["quantity"]
+        
+        i = self._row_index(recipe_id)
+        if i is None:
+            self.recipe_ids = np.append(self.recipe_ids, np.int64(recipe_id))
+            self.ratings = np.append(self.ratings, float(rating))
+            self.X = np.vstack([self.X, row[np.newaxis, :]])
+        else:
+            self.ratings[i] = rating
+            self.X[i] = row
+        if rehash:
+            self.content_hash = self._hash()
+    
+    def remove(self, recipe_id: int) -> None:
+        i = self._row_index(recipe_id)
+        if i is not None:
+            self.recipe_ids = np.delete(self.recipe_ids, i)
+            self.ratings = np.delete(self.ratings, i)
+            self.X = np.delete(self.X, i, axis=0)
+            self.content_hash = self._hash()
+    
+    def matrix(self) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """
+        Training matrix with the same column layout _prepare_data builds:
+        only features used by some recipe, in sorted key order.
+        """
+        used = [i for i in range(len(self.keys)) if self.X[:, i].any()]
+        used.sort(key=lambda i: self.keys[i])
+        return self.X[:, used], self.ratings.copy(), [self.keys[i] for i in used]
+    
+    def recipe_ingredients(self, recipe_id: int) -> Optional[List[Dict[str, Any]]]:
+        i = self._row_index(recipe_id)
+        if i is None:
+            return None
+        ingredients = []
+        for col in np.flatnonzero(self.X[i]):
+            ingredient_id, unit = self.keys[col].split("_", 1)
+            ingredients.append({
+                "ingredient_id": int(ingredient_id),
+                "ingredient_name": self.name(int(ingredient_id)),
+                "quantity": float(self.X[i, col]),
+                "unit": unit
+            })
+        return ingredients
+    
+    def to_recipes_data(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "id": int(recipe_id),
+                "rating": float(rating),
+                "ingredients": self.recipe_ingredients(int(recipe_id))
+            }
+            for recipe_id, rating in zip(self.recipe_ids, self.ratings)
+        ]
+
+# Parsed stores keyed by meal id, reused while the file is unchanged
+_loaded = TTLCache(maxsize=settings.FEATURE_STORE_CACHE_MEALS, ttl=3600)
+_write_lock = threading.Lock()
+
+def _get_path(meal_id: int) -> str:
+    return os.path.join(settings.FEATURE_STORE_DIR, f"meal_{meal_id}.npz")
+
+@contextmanager
+def _locked(meal_id: int) -> Iterator[None]:
+    """Serialize read-modify-write of a meal's store across threads and workers."""
+    os.makedirs(settings.FEATURE_STORE_DIR, exist_ok=True)
+    with _write_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(f"{_get_path(meal_id)}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read(meal_id: int) -> Optional[MealFeatures]:
+    path = _get_path(meal_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    
+    cached = _loaded.get(meal_id)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    
+    with np.load(path, allow_pickle=False) as data:
+        features = MealFeatures(
+            recipe_ids=data["recipe_ids"],
+            ratings=data["ratings"],
+            X=data["X"],
+            keys=[str(key) for key in data["keys"]],
+            names=dict(zip(data["name_ids"].tolist(), [str(name) for name in data["names"]])),
+            content_hash=str(data["content_hash"]),
+        )
+    _loaded.set(meal_id, (mtime, features))
+    return features
+
+def _write(meal_id: int, features: MealFeatures) -> None:
+    path = _get_path(meal_id)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(
+        tmp_path,
+        recipe_ids=features.recipe_ids,
+        ratings=features.ratings,
+        X=features.X,
+        keys=np.array(features.keys, dtype=str),
+        name_ids=np.array(list(features.names.keys()), dtype=np.int64),
+        names=np.array(list(features.names.values()), dtype=str),
+        content_hash=np.array(features.content_hash),
+    )
+    os.replace(tmp_path, path)
+    _loaded.pop(meal_id)
+
+def get_meal_features(db: Session, meal_id: int, rebuild: bool = False) -> MealFeatures:
+    """
+    Load a meal's features in one file read, building the store from the
+    database the first time. Callers must treat the result as read-only.
+    """
+    if not rebuild:
+        features = _read(meal_id)
+        if features is not None:
+            return features
+    
+    from app.ml.training import get_recipes_data_for_meal
+    
+    with _locked(meal_id):
+        features = None if rebuild else _read(meal_id)
+        if features is None:
+            features = MealFeatures.from_recipes_data(get_recipes_data_for_meal(db, meal_id))
+            _write(meal_id, features)
+    return features
+
+def recipe_written(recipe: Any) -> None:
+    """Patch an existing store after a recipe is created or updated."""
+    with _locked(recipe.meal_id):
+        features = _read(recipe.meal_id)
+        if features is None:
+            return  # Built from the database on first read
+        features = MealFeatures(
+            features.recipe_ids.copy(), features.ratings.copy(), features.X.copy(),
+            list(features.keys), dict(features.names), features.content_hash
+        )
+        features.upsert(recipe.id, recipe.rating, [
+            {
+                "ingredient_id": ri.ingredient_id,
+                "ingredient_name": ri.ingredient_name,
+                "quantity": ri.quantity,
+                "unit": ri.unit
+            }
+            for ri in recipe.ingredients
+        ])
+        _write(recipe.meal_id, features)
+
+def recipe_deleted(meal_id: int, recipe_id: int) -> None:
+    with _locked(meal_id):
+        features = _read(meal_id)
+        if features is None:
+            return
+        features = MealFeatures(
+            features.recipe_ids.copy(), features.ratings.copy(), features.X.copy(),
+            list(features.keys), dict(features.names), features.content_hash
+        )
+        features.remove(recipe_id)
+        _write(meal_id, features)
+
+def meal_deleted(meal_id: int) -> None:
+    with _locked(meal_id):
+        _loaded.pop(meal_id)
+        if os.path.exists(_get_path(meal_id)):
+            os.remove(_get_path(meal_id))
+
+# app/ml/registry.py
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import json
+import logging
+import os
+import threading
+import time
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# (model_dir, model_type, user_id, meal_id)
+ModelKey = Tuple[str, str, int, int]
+
+ACCESS_STATS_FILE = "access_stats.json"
+
+class LoadedModel(NamedTuple):
+    """A model's fitted state as loaded from (or just written to) disk."""
+    fingerprint: Optional[str]
+    version: str
+    model: Any
+    feature_names: Dict[str, int]
+    uncertainty: Optional[Dict[str, Any]]
+    metrics: Optional[Dict[str, Any]]
+
+# Loaded models shared by every optimizer in this process. Entries a prefork
+# master preloads are inherited copy-on-write by its workers.
+_models: "OrderedDict[ModelKey, LoadedModel]" = OrderedDict()
+_models_lock = threading.Lock()
+
+# Access counts not yet merged into the on-disk stats
+_pending: Dict[ModelKey, int] = {}
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+def get(key: ModelKey) -> Optional[LoadedModel]:
+    with _models_lock:
+        entry = _models.get(key)
+        if entry is not None:
+            _models.move_to_end(key)
+        return entry
+
+def put(key: ModelKey, entry: LoadedModel) -> None:
+    with _models_lock:
+        _models[key] = entry
+        _models.move_to_end(key)
+        while len(_models) > max(1, settings.ML_MODEL_CACHE_SIZE):
+            _models.popitem(last=False)
+
+def clear() -> None:
+    with _models_lock:
+        _models.clear()
+
+def keys() -> List[ModelKey]:
+    with _models_lock:
+        return list(_models)
+
+def record_access(key: ModelKey) -> None:
+    """Count a model use; counts are merged to disk at most once per flush interval."""
+    global _last_flush
+    with _pending_lock:
+        _pending[key] = _pending.get(key, 0) + 1
+        due = time.monotonic() - _last_flush >= settings.ML_ACCESS_STATS_FLUSH_SECONDS
+        if due:
+            _last_flush = time.monotonic()
+    if due:
+        flush_access_stats()
+
+def _stats_key(model_type: str, user_id: int, meal_id: int) -> str:
+    return f"{model_type}:{user_id}:{meal_id}"
+
+def _decayed(entry: Dict[str, float], now: float) -> float:
+    half_life = settings.ML_ACCESS_STATS_HALF_LIFE_HOURS * 3600
+    return entry["score"] * 0.5 ** ((now - entry["at"]) / half_life)
+
+def _read_stats(path: str) -> Dict[str, Dict[str, float]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def flush_access_stats() -> None:
+    """Merge pending access counts into each model dir's decayed stats file."""
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    by_dir: Dict[str, Dict[str, int]] = {}
+    for (model_dir, model_type, user_id, meal_id), count in pending.items():
+        by_dir.setdefault(model_dir, {})[_stats_key(model_type, user_id, meal_id)] = count
+    
+    now = time.time()
+    for model_dir, counts in by_dir.items():
+        path = os.path.join(model_dir, ACCESS_STATS_FILE)
+        try:
+            with open(f"{path}.lock", "w") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                stats = _read_stats(path)
+                for key, count in counts.items():
+                    score = _decayed(stats[key], now) if key in stats else 0.0
+                    stats[key] = {"score": score + count, "at": now}
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(stats, f)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error writing model access stats: {e}")
+
+def hot_models(model_dir: str, limit: int) -> List[Tuple[str, int, int]]:
+    """The most used (model_type, user_id, meal_id) in model_dir, by decayed access count."""
+    now = time.time()
+    stats = _read_stats(os.path.join(model_dir, ACCESS_STATS_FILE))
+    ranked = sorted(stats.items(), key=lambda item: _decayed(item[1], now), reverse=True)
+    hot = []
+    for key, _ in ranked[:limit]:
+        model_type, user_id, meal_id = key.rsplit(":", 2)
+        hot.append((model_type, int(user_id), int(meal_id)))
+    return hot
+
+# app/ml/prediction_cache.py
+from typing import Callable, Dict, List, Optional, Tuple
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.ml import metrics as ml_metrics
+
+logger = logging.getLogger(__name__)
+
+# SQLite caps bound parameters per statement
+_CHUNK = 500
+
+PredictFn = Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+class SharedPredictionStore:
+    """
+    Prediction results in a SQLite file, shared by every worker process on
+    the host. Entries expire after a TTL and the least recently used are
+    evicted beyond max_entries. Lock contention is treated as a miss.
+    """
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=0.1, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key BLOB PRIMARY KEY, model TEXT NOT NULL, version TEXT NOT NULL, "
+            "prediction REAL NOT NULL, std REAL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_predictions_model ON predictions (model, version)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_predictions_used_at ON predictions (used_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, Tuple[float, float]]:
+        found: Dict[bytes, Tuple[float, float]] = {}
+        now = time.time()
+        try:
+            conn = self._connection()
+            for start in range(0, len(keys), _CHUNK):
+                chunk = keys[start:start + _CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, prediction, std FROM predictions WHERE key IN ({marks}) AND expires_at > ?",
+                    (*chunk, now),
+                ).fetchall()
+                for key, prediction, std in rows:
+                    found[key] = (prediction, np.nan if std is None else std)
+            if found:
+                hits = list(found)
+                for start in range(0, len(hits), _CHUNK):
+                    chunk = hits[start:start + _CHUNK]
+                    conn.execute(
+                        f"UPDATE predictions SET used_at = ? WHERE key IN ({','.join('?' * len(chunk))})",
+                        (now, *chunk),
+                    )
+        except sqlite3.Error as e:
+            logger.debug(f"Prediction cache read skipped: {e}")
+        return found
+
+    def put_many(self, model: str, version: str, items: List[Tuple[bytes, float, float]]) -> None:
+        now = time.time()
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(key, model, version, prediction, None if np.isnan(std) else std, now + self.ttl, now)
+                     for key, prediction, std in items],
+                )
+            self._writes += len(items)
+            if self._writes >= max(1, self.max_entries // 10):
+                self._writes = 0
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            logger.debug(f"Prediction cache write skipped: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM predictions WHERE expires_at <= ?", (now,))
+            excess = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM predictions WHERE key IN "
+                    "(SELECT key FROM predictions ORDER BY used_at LIMIT ?)",
+                    (excess,),
+                )
+
+    def invalidate(self, model: str, keep_version: Optional[str] = None) -> None:
+        """Drop a model's entries from every version but keep_version."""
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "DELETE FROM predictions WHERE model = ? AND version != ?", (model, keep_version or "")
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Prediction cache invalidation failed: {e}")
+
+# Per-process level in front of the shared store; keys embed the model
+# version, so a retrained model never reads a stale entry
+_local = TTLCache(maxsize=settings.PREDICTION_CACHE_LOCAL_ENTRIES, ttl=settings.PREDICTION_CACHE_TTL_SECONDS)
+_shared = SharedPredictionStore(
+    settings.PREDICTION_CACHE_PATH,
+    ttl=settings.PREDICTION_CACHE_TTL_SECONDS,
+    max_entries=settings.PREDICTION_CACHE_MAX_ENTRIES,
+) if settings.PREDICTION_CACHE_PATH else None
+
+def vector_key(model: str, version: str, row: np.ndarray) -> bytes:
+    """
+    Key of a feature row under one model version: the row's non-zero
+    (index, value) pairs, so equal recipes hash equally whatever the
+    order their ingredients were listed in.
+    """
+    nonzero = np.flatnonzero(row)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{model}\0{version}\0".encode())
+    digest.update(nonzero.astype("<i4").tobytes())
+    digest.update(np.asarray(row)[nonzero].astype("<f8").tobytes())
+    return digest.digest()
+
+def predict_batch(model: str, version: str, model_type: str, X: np.ndarray,
+                  predict: PredictFn) -> Tuple[np.ndarray, np.ndarray]:
+    """predict(X) with each row's result served from the cache when present."""
+    keys = [vector_key(model, version, row) for row in X]
+    predictions = np.empty(len(keys))
+    std = np.empty(len(keys))
+    missing = []
+    for i, key in enumerate(keys):
+        value = _local.get(key)
+        if value is None:
+            missing.append(i)
+        else:
+            predictions[i], std[i] = value
+    
+    if missing and _shared is not None:
+        found = _shared.get_many([keys[i] for i in missing])
+        still_missing = []
+        for i in missing:
+            value = found.get(keys[i])
+            if value is None:
+                still_missing.append(i)
+            else:
+                predictions[i], std[i] = value
+                _local.set(keys[i], value)
+        missing = still_missing
+    
+    hits = len(keys) - len(missing)
+    if hits:
+        ml_metrics.MODEL_CACHE.labels(model_type=model_type, cache="prediction", result="hit").inc(hits)
+    if missing:
+        ml_metrics.MODEL_CACHE.labels(model_type=model_type, cache="prediction", result="miss").inc(len(missing))
+        computed, computed_std = predict(X[missing])
+        items = []
+        for i, prediction, prediction_std in zip(missing, computed, computed_std):
+            value = (float(prediction), float(prediction_std))
+            predictions[i], std[i] = value
+            _local.set(keys[i], value)
+            items.append((keys[i], *value))
+        if _shared is not None:
+            _shared.put_many(model, version, items)
+    return predictions, std
+
+def invalidate(model: str, keep_version: Optional[str] = None) -> None:
+    """Forget a model's cached predictions (except keep_version's), here and in the shared store."""
+    if _shared is not None:
+        _shared.invalidate(model, keep_version)
+
 # app/ml/models.py
 from sklearn.linear_model import LinearRegression, Ridge, Lasso
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.svm import SVR
 from sklearn.pipeline import Pipeline
+from sklearn.base import clone
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, KFold, ParameterGrid
 import numpy as np
 import pandas as pd
 import joblib
+from joblib import Parallel, delayed
+import copy
 import os
-from typing import Dict, List, Tuple, Optional, Any
+import pickle
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple, Optional, Any, Union
 import logging
 
+from app.core import profiling
+from app.core.config import settings
+from app.ml import metrics as ml_metrics
+from app.ml import prediction_cache
+from app.ml import registry as model_registry
+from app.ml.feature_store import MealFeatures
+
 logger = logging.getLogger(__name__)
 
 MODEL_TYPES = {
@@ -62,12 +767,124 @@ MODEL_TYPES = {
     }
 }
 
+# Pseudo model type: train every entry of MODEL_TYPES and keep the winner
+AUTO_MODEL_TYPE = "auto"
+
+# Per-meal model type used when a request names none
+DEFAULT_MODEL_TYPE = "random_forest"
+
+# Size of the bootstrap ensemble used for uncertainty on models without a
+# native variance estimate (gradient boosting, SVR)
+BOOTSTRAP_ESTIMATORS = 16
+
+# Confidence reported when a model carries no uncertainty state
+DEFAULT_CONFIDENCE = 0.7
+
+# Rows in the batch used to time predictions before/after compaction
+COMPACT_PROBE_ROWS = 64
+
+def uncertainty_to_confidence(std: np.ndarray) -> np.ndarray:
+    """Map predictive standard deviation (rating points) to a 0-1 confidence."""
+    std = np.asarray(std, dtype=float)
+    return np.where(np.isnan(std), DEFAULT_CONFIDENCE, 1.0 / (1.0 + np.nan_to_num(std)))
+
+def get_search_config(model_type: str) -> Dict[str, Any]:
+    """Hyperparameter search settings that determine a trained artifact."""
+    if model_type == AUTO_MODEL_TYPE:
+        params = {name: info["params"] for name, info in MODEL_TYPES.items()}
+    else:
+        params = MODEL_TYPES[model_type]["params"]
+    return {
+        "model_type": model_type,
+        "params": params,
+        "max_cv_folds": 5,
+        "scoring": "neg_mean_squared_error",
+    }
+
+def dump_atomic(value: Any, path: str) -> None:
+    """joblib.dump via a temporary file so readers never see a partial artifact."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    joblib.dump(value, tmp_path)
+    os.replace(tmp_path, path)
+
+def _model_size(model: Any) -> int:
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+def _prune_forest(forest: RandomForestRegressor, X_scaled: np.ndarray, y: np.ndarray) -> int:
+    """
+    Truncate a fitted forest to the shortest prefix of trees whose
+    out-of-bag MSE is within ML_COMPACT_TOLERANCE of the whole forest's.
+    Trees are i.i.d., so a prefix is as good as any subset of its size.
+    """
+    n_trees = len(forest.estimators_)
+    min_trees = min(settings.ML_COMPACT_MIN_TREES, n_trees)
+    if not forest.bootstrap or n_trees <= min_trees:
+        return n_trees
+    
+    tree_predictions = np.stack([tree.predict(X_scaled) for tree in forest.estimators_])
+    out_of_bag = np.ones(tree_predictions.shape, dtype=bool)
+    for t, samples in enumerate(forest.estimators_samples_):
+        out_of_bag[t, samples] = False
+    
+    # Out-of-bag prediction of every row for each prefix of the forest
+    sums = np.cumsum(np.where(out_of_bag, tree_predictions, 0.0), axis=0)
+    counts = np.cumsum(out_of_bag, axis=0)
+    errors = np.full(n_trees, np.inf)
+    for k in range(n_trees):
+        covered = counts[k] > 0
+        if covered.any():
+            errors[k] = np.mean((sums[k, covered] / counts[k, covered] - y[covered]) ** 2)
+    
+    keep = n_trees
+    if np.isfinite(errors[-1]):
+        limit = errors[-1] * (1.0 + settings.ML_COMPACT_TOLERANCE)
+        within = np.flatnonzero(errors[min_trees - 1:] <= limit)
+        if len(within):
+            keep = min_trees + int(within[0])
+    
+    forest.estimators_ = forest.estimators_[:keep]
+    forest.n_estimators = keep
+    return keep
+
+def _as_float32(component: Any) -> Any:
+    """
+    Copy of a fitted scaler or linear model with float32 parameters.
+    Tree ensembles and SVR keep their (fixed-dtype) internals.
+    """
+    if isinstance(component, StandardScaler):
+        component = copy.copy(component)
+        for attr in ("mean_", "scale_", "var_"):
+            if getattr(component, attr, None) is not None:
+                setattr(component, attr, getattr(component, attr).astype(np.float32))
+    elif isinstance(component, (LinearRegression, Ridge, Lasso)):
+        component = copy.copy(component)
+        component.coef_ = np.asarray(component.coef_, dtype=np.float32)
+        component.intercept_ = np.float32(component.intercept_)
+    return component
+
+def _score_candidate(model_type: str, params: Dict[str, Any],
+                     folds: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]) -> float:
+    """Mean validation MSE of one model/params combination over pre-scaled folds."""
+    errors = []
+    for X_train, y_train, X_test, y_test in folds:
+        try:
+            model = MODEL_TYPES[model_type]["model"](**params)
+            model.fit(X_train, y_train)
+            errors.append(float(np.mean((model.predict(X_test) - y_test) ** 2)))
+        except Exception:
+            return float("inf")
+    return float(np.mean(errors))
+
 class RecipeOptimizer:
     def __init__(self, model_type: str = "linear", model_dir: str = "./models"):
         self.model_type = model_type
         self.model_dir = model_dir
         self.model = None
         self.feature_names = None
+        self.uncertainty = None
+        # Identifies the loaded artifact: training fingerprint and save time
+        self.version = None
+        self.cache_id = None
         
         # Create model directory if it doesn't exist
         os.makedirs(model_dir, exist_ok=True)
@@ -78,13 +895,46 @@ class RecipeOptimizer:
     
     def _get_feature_names_path(self, user_id: int, meal_id: int) -> str:
         """Generate path for saving/loading feature names."""
-        return os.path.join(self.model_dir, f"user_{user_id}_meal_{meal_id}_features.joblib")
+        return os.path.join(self.model_dir, f"user_{user_id}_meal_{meal_id}_{self.model_type}_features.joblib")
+    
+    def _get_metadata_path(self, user_id: int, meal_id: int) -> str:
+        """Generate path for saving/loading training fingerprint and metrics."""
+        return os.path.join(self.model_dir, f"user_{user_id}_meal_{meal_id}_{self.model_type}_meta.joblib")
+    
+    def _get_uncertainty_path(self, user_id: int, meal_id: int) -> str:
+        """Generate path for saving/loading the fitted uncertainty state."""
+        return os.path.join(self.model_dir, f"user_{user_id}_meal_{meal_id}_{self.model_type}_uncertainty.joblib")
+    
+    def _get_optimizations_path(self, user_id: int, meal_id: int) -> str:
+        """Generate path for saving/loading precomputed recipe optimizations."""
+        return os.path.join(self.model_dir, f"user_{user_id}_meal_{meal_id}_{self.model_type}_optimized.joblib")
+    
+    def save_optimizations(self, user_id: int, meal_id: int, fingerprint: Optional[str],
+                           results: Dict[int, Dict[str, Any]]) -> None:
+        """Persist optimizations computed with the model trained on fingerprint."""
+        dump_atomic({"fingerprint": fingerprint, "results": results}, self._get_optimizations_path(user_id, meal_id))
+    
+    def load_optimizations(self, user_id: int, meal_id: int) -> Optional[Dict[str, Any]]:
+        """Load precomputed optimizations if any exist."""
+        path = self._get_optimizations_path(user_id, meal_id)
+        try:
+            if os.path.exists(path):
+                return joblib.load(path)
+            return None
+        except Exception as e:
+            logger.error(f"Error loading precomputed optimizations: {e}")
+            return None
     
-    def _prepare_data(self, recipes: List[Dict]) -> Tuple[pd.DataFrame, np.ndarray]:
+    def _prepare_data(self, recipes: Union[List[Dict], MealFeatures]) -> Tuple[pd.DataFrame, np.ndarray]:
         """
         Convert recipe data into feature matrix and target vector.
         Each recipe contains ingredients with quantities.
         """
+        if isinstance(recipes, MealFeatures):
+            X, y, keys = recipes.matrix()
+            self.feature_names = {key: i for i, key in enumerate(keys)}
+            return pd.DataFrame(X, columns=keys), y
+        
         # Gather all unique ingredients across all recipes
         all_ingredients = set()
         for recipe in recipes:
@@ -109,15 +959,20 @@ class RecipeOptimizer:
         
         return pd.DataFrame(X, columns=list(self.feature_names.keys())), y
     
-    def train(self, recipes: List[Dict], user_id: int, meal_id: int) -> Dict[str, Any]:
+    def train(self, recipes: List[Dict], user_id: int, meal_id: int,
+              fingerprint: Optional[str] = None) -> Dict[str, Any]:
         """
         Train model on recipe data.
         Return metrics on model performance.
+        When a fingerprint is given it is stored with the model so an
+        identical dataset can reuse the artifact later.
         """
         if len(recipes) < 2:
             raise ValueError("Need at least 2 recipes to train a model")
         
-        X, y = self._prepare_data(recipes)
+        with ml_metrics.stage("prepare", self.model_type):
+            X, y = self._prepare_data(recipes)
+        profiling.annotate(stage="train", model_type=self.model_type, rows=len(X), features=len(X.columns))
         
         # Create pipeline with standardization and the selected model
         model_info = MODEL_TYPES[self.model_type]
@@ -130,33 +985,245 @@ class RecipeOptimizer:
         grid_search = GridSearchCV(
             pipeline,
             param_grid={f"model__{k}": v for k, v in model_info["params"].items()},
-            cv=min(5, len(recipes)),  # Adjust cross-validation based on available data
-            scoring='neg_mean_squared_error'
+            cv=min(get_search_config(self.model_type)["max_cv_folds"], len(recipes)),  # Adjust cross-validation based on available data
+            scoring=get_search_config(self.model_type)["scoring"]
         )
         
         # Train model
         if len(X) > 0 and len(X.columns) > 0:
             try:
-                grid_search.fit(X, y)
+                with ml_metrics.stage("fit", self.model_type):
+                    grid_search.fit(X, y)
                 self.model = grid_search.best_estimator_
                 
-                # Save model and feature names
-                joblib.dump(self.model, self._get_model_path(user_id, meal_id))
-                joblib.dump(self.feature_names, self._get_feature_names_path(user_id, meal_id))
+                self._fit_uncertainty(X, y)
                 
-                # Return metrics
-                return {
+                metrics = {
                     "best_score": -grid_search.best_score_,  # Convert back from negative MSE
                     "best_params": grid_search.best_params_,
                     "feature_count": len(self.feature_names),
                     "sample_count": len(recipes)
                 }
+                if settings.ML_COMPACT_MODELS:
+                    with ml_metrics.stage("compact", self.model_type):
+                        metrics["compaction"] = self._compact(X, y)
+                self._save(user_id, meal_id, fingerprint, metrics)
+                
+                # Return metrics
+                return metrics
             except Exception as e:
                 logger.error(f"Error training model: {e}")
                 raise
         else:
             raise ValueError("No features available for training")
     
+    def train_all(self, recipes: List[Dict], user_id: int, meal_id: int,
+                  fingerprint: Optional[str] = None, n_jobs: int = -1) -> Dict[str, Any]:
+        """
+        Evaluate every model type in MODEL_TYPES on one set of CV folds and
+        persist the best one as the "auto" model, with a leaderboard.
+        Data preparation, fold splitting and scaling happen once and are
+        shared by all candidates, which are scored on a process pool.
+        """
+        if len(recipes) < 2:
+            raise ValueError("Need at least 2 recipes to train a model")
+        
+        with ml_metrics.stage("prepare", AUTO_MODEL_TYPE):
+            X, y = self._prepare_data(recipes)
+        if len(X) == 0 or len(X.columns) == 0:
+            raise ValueError("No features available for training")
+        
+        config = get_search_config(AUTO_MODEL_TYPE)
+        X_values = X.to_numpy()
+        folds = []
+        for train_idx, test_idx in KFold(n_splits=min(config["max_cv_folds"], len(recipes))).split(X_values):
+            scaler = StandardScaler().fit(X_values[train_idx])
+            folds.append((
+                scaler.transform(X_values[train_idx]), y[train_idx],
+                scaler.transform(X_values[test_idx]), y[test_idx]
+            ))
+        
+        candidates = [
+            (model_type, params)
+            for model_type, info in MODEL_TYPES.items()
+            for params in ParameterGrid(info["params"])
+        ]
+        with ml_metrics.stage("fit", AUTO_MODEL_TYPE):
+            scores = Parallel(n_jobs=n_jobs)(
+                delayed(_score_candidate)(model_type, params, folds) for model_type, params in candidates
+            )
+        
+        # Best parameters per model type, ranked by validation MSE
+        best_by_type: Dict[str, Dict[str, Any]] = {}
+        for (model_type, params), score in zip(candidates, scores):
+            if model_type not in best_by_type or score < best_by_type[model_type]["best_score"]:
+                best_by_type[model_type] = {
+                    "model_type": model_type,
+                    "best_score": score,
+                    "best_params": params,
+                }
+        leaderboard = sorted(best_by_type.values(), key=lambda entry: entry["best_score"])
+        winner = leaderboard[0]
+        if not np.isfinite(winner["best_score"]):
+            raise ValueError("No model type could be trained on this data")
+        
+        self.model = Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', MODEL_TYPES[winner["model_type"]]["model"](**winner["best_params"]))
+        ])
+        self.model.fit(X, y)
+        self._fit_uncertainty(X, y)
+        
+        metrics = {
+            "best_score": winner["best_score"],
+            "best_params": {f"model__{k}": v for k, v in winner["best_params"].items()},
+            "best_model_type": winner["model_type"],
+            "leaderboard": leaderboard,
+            "feature_count": len(self.feature_names),
+            "sample_count": len(recipes)
+        }
+        if settings.ML_COMPACT_MODELS:
+            with ml_metrics.stage("compact", AUTO_MODEL_TYPE):
+                metrics["compaction"] = self._compact(X, y)
+        self._save(user_id, meal_id, fingerprint, metrics)
+        
+        return metrics
+    
+    def _save(self, user_id: int, meal_id: int, fingerprint: Optional[str], metrics: Dict[str, Any]) -> None:
+        """Persist model, feature names, uncertainty state and metadata."""
+        dump_atomic(self.model, self._get_model_path(user_id, meal_id))
+        dump_atomic(self.feature_names, self._get_feature_names_path(user_id, meal_id))
+        dump_atomic(self.uncertainty, self._get_uncertainty_path(user_id, meal_id))
+        
+        # Metadata is written last so a partial save never looks current
+        metadata = {"fingerprint": fingerprint, "metrics": metrics}
+        metadata_path = self._get_metadata_path(user_id, meal_id)
+        dump_atomic(metadata, metadata_path)
+        self._remember(user_id, meal_id, metadata, os.stat(metadata_path).st_mtime_ns)
+        # Every worker's cached predictions for the replaced model are now dead
+        prediction_cache.invalidate(self.cache_id, keep_version=self.version)
+    
+    def _fit_uncertainty(self, X: pd.DataFrame, y: np.ndarray) -> None:
+        """
+        Precompute what is needed to estimate predictive uncertainty:
+        nothing for forests (per-tree spread), residual variance and
+        (X^T X)^-1 for linear models, a bootstrap ensemble otherwise.
+        """
+        scaler, estimator = self.model.steps[0][1], self.model.steps[-1][1]
+        X_scaled = scaler.transform(np.asarray(X, dtype=float))
+        
+        if isinstance(estimator, RandomForestRegressor):
+            self.uncertainty = {"kind": "forest"}
+        elif isinstance(estimator, (LinearRegression, Ridge, Lasso)):
+            design = self._design_matrix(X_scaled, estimator.fit_intercept)
+            residuals = y - estimator.predict(X_scaled)
+            dof = max(len(y) - np.linalg.matrix_rank(design), 1)
+            self.uncertainty = {
+                "kind": "linear",
+                "fit_intercept": estimator.fit_intercept,
+                "sigma2": float(residuals @ residuals / dof),
+                "xtx_inv": np.linalg.pinv(design.T @ design),
+            }
+        else:
+            rng = np.random.RandomState(0)
+            members = []
+            for _ in range(BOOTSTRAP_ESTIMATORS):
+                idx = rng.randint(0, len(y), len(y))
+                members.append(clone(estimator).fit(X_scaled[idx], y[idx]))
+            self.uncertainty = {"kind": "bootstrap", "members": members}
+    
+    def _compact(self, X: pd.DataFrame, y: np.ndarray) -> Dict[str, Any]:
+        """
+        Shrink the fitted model for serving: prune a forest to the smallest
+        prefix of its trees whose out-of-bag error stays within
+        ML_COMPACT_TOLERANCE of the full forest, then switch inference to
+        float32 if predictions move by at most ML_COMPACT_FLOAT32_MAX_ERROR.
+        Returns size and latency before and after.
+        """
+        X_values = np.asarray(X, dtype=np.float64)
+        probe = X_values[np.resize(np.arange(len(X_values)), COMPACT_PROBE_ROWS)]
+        report = {
+            "size_bytes_before": _model_size(self.model),
+            "predict_ms_before": self._time_predict(probe),
+        }
+        
+        scaler, estimator = self.model.steps[0][1], self.model.steps[-1][1]
+        if isinstance(estimator, RandomForestRegressor):
+            report["trees_before"] = len(estimator.estimators_)
+            report["trees_after"] = _prune_forest(estimator, scaler.transform(X_values), y)
+        
+        reference = self._predict_batch(X_values)[0]
+        full_precision = self.model
+        self.model = Pipeline([('scaler', _as_float32(scaler)), ('model', _as_float32(estimator))])
+        float32_error = float(np.max(np.abs(self._predict_batch(X_values)[0] - reference)))
+        if float32_error > settings.ML_COMPACT_FLOAT32_MAX_ERROR:
+            self.model = full_precision
+        
+        report.update({
+            "dtype": np.dtype(self._input_dtype()).name,
+            "float32_max_error": float32_error,
+            "size_bytes_after": _model_size(self.model),
+            "predict_ms_after": self._time_predict(probe),
+        })
+        return report
+    
+    def _input_dtype(self) -> type:
+        # Compacted models carry float32 scaler statistics
+        scaler = self.model.steps[0][1]
+        mean = getattr(scaler, "mean_", None)
+        return np.float32 if mean is not None and mean.dtype == np.float32 else np.float64
+    
+    def _time_predict(self, X: np.ndarray) -> float:
+        start = time.perf_counter()
+        self._predict_batch(X)
+        return (time.perf_counter() - start) * 1000
+    
+    @staticmethod
+    def _design_matrix(X_scaled: np.ndarray, fit_intercept: bool) -> np.ndarray:
+        if fit_intercept:
+            return np.hstack([np.ones((len(X_scaled), 1)), X_scaled])
+        return X_scaled
+    
+    def _predict_batch(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Predict ratings and their standard deviations for a batch of feature
+        rows in a single pass over the model.
+        """
+        scaler, estimator = self.model.steps[0][1], self.model.steps[-1][1]
+        X_scaled = scaler.transform(np.asarray(X, dtype=self._input_dtype()))
+        kind = (self.uncertainty or {}).get("kind")
+        
+        if isinstance(estimator, RandomForestRegressor):
+            # The forest mean is the mean of its trees, so this is the prediction pass
+            tree_predictions = np.stack([tree.predict(X_scaled) for tree in estimator.estimators_])
+            return tree_predictions.mean(axis=0), tree_predictions.std(axis=0)
+        
+        predictions = estimator.predict(X_scaled)
+        if kind == "linear":
+            design = self._design_matrix(X_scaled, self.uncertainty["fit_intercept"])
+            leverage = np.einsum("ij,jk,ik->i", design, self.uncertainty["xtx_inv"], design)
+            std = np.sqrt(self.uncertainty["sigma2"] * (1.0 + leverage))
+        elif kind == "bootstrap":
+            std = np.stack([member.predict(X_scaled) for member in self.uncertainty["members"]]).std(axis=0)
+        else:
+            std = np.full(len(predictions), np.nan)
+        return predictions, std
+    
+    def _predict_cached(self, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """_predict_batch through the prediction cache when the model is a saved artifact."""
+        if not settings.PREDICTION_CACHE_ENABLED or self.version is None:
+            return self._predict_batch(X)
+        return prediction_cache.predict_batch(self.cache_id, self.version, self.model_type, X, self._predict_batch)
+    
+    def _vectorize(self, recipe_ingredients: List[Dict]) -> np.ndarray:
+        """Build a single feature row from a recipe's ingredients."""
+        X = np.zeros((1, len(self.feature_names)), dtype=self._input_dtype())
+        for ingredient in recipe_ingredients:
+            key = f"{ingredient['ingredient_id']}_{ingredient['unit']}"
+            if key in self.feature_names:
+                X[0, self.feature_names[key]] = ingredient["quantity"]
+        return X
+    
     def load(self, user_id: int, meal_id: int) -> bool:
         """Load a trained model if it exists."""
         model_path = self._get_model_path(user_id, meal_id)
@@ -164,79 +1231,156 @@ class RecipeOptimizer:
         
         try:
             if os.path.exists(model_path) and os.path.exists(features_path):
-                self.model = joblib.load(model_path)
-                self.feature_names = joblib.load(features_path)
+                uncertainty_path = self._get_uncertainty_path(user_id, meal_id)
+                with ml_metrics.stage("load", self.model_type):
+                    self.model = joblib.load(model_path)
+                    self.feature_names = joblib.load(features_path)
+                    self.uncertainty = joblib.load(uncertainty_path) if os.path.exists(uncertainty_path) else None
+                ml_metrics.ARTIFACT_BYTES_LOADED.labels(model_type=self.model_type).inc(sum(
+                    os.path.getsize(path) for path in (model_path, features_path, uncertainty_path)
+                    if os.path.exists(path)
+                ))
                 return True
             return False
         except Exception as e:
             logger.error(f"Error loading model: {e}")
             return False
     
+    def load_if_current(self, user_id: int, meal_id: int, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """
+        Load the persisted model only if it was trained on data with the
+        given fingerprint. Returns its stored metrics, or None.
+        """
+        key = self._registry_key(user_id, meal_id)
+        cached = model_registry.get(key)
+        if cached is not None and cached.fingerprint == fingerprint:
+            self._adopt(cached, user_id, meal_id)
+            model_registry.record_access(key)
+            return cached.metrics
+        
+        metadata_path = self._get_metadata_path(user_id, meal_id)
+        try:
+            if not os.path.exists(metadata_path):
+                return None
+            mtime_ns = os.stat(metadata_path).st_mtime_ns
+            metadata = joblib.load(metadata_path)
+        except Exception as e:
+            logger.error(f"Error loading model metadata: {e}")
+            return None
+        
+        if metadata.get("fingerprint") != fingerprint or not self.load(user_id, meal_id):
+            return None
+        self._remember(user_id, meal_id, metadata, mtime_ns)
+        model_registry.record_access(key)
+        return metadata.get("metrics")
+    
+    def preload(self, user_id: int, meal_id: int) -> bool:
+        """Load the persisted model into the process-wide registry, whatever its fingerprint."""
+        metadata_path = self._get_metadata_path(user_id, meal_id)
+        try:
+            mtime_ns = os.stat(metadata_path).st_mtime_ns
+            metadata = joblib.load(metadata_path)
+        except Exception as e:
+            logger.error(f"Error loading model metadata: {e}")
+            return False
+        if not self.load(user_id, meal_id):
+            return False
+        self._remember(user_id, meal_id, metadata, mtime_ns)
+        return True
+    
+    def _registry_key(self, user_id: int, meal_id: int) -> model_registry.ModelKey:
+        return (self.model_dir, self.model_type, user_id, meal_id)
+    
+    def _cache_id(self, user_id: int, meal_id: int) -> str:
+        return "|".join(str(part) for part in self._registry_key(user_id, meal_id))
+    
+    def _remember(self, user_id: int, meal_id: int, metadata: Dict[str, Any], mtime_ns: int) -> None:
+        entry = model_registry.LoadedModel(
+            fingerprint=metadata.get("fingerprint"),
+            version=f"{metadata.get('fingerprint')}:{mtime_ns}",
+            model=self.model,
+            feature_names=self.feature_names,
+            uncertainty=self.uncertainty,
+            metrics=metadata.get("metrics"),
+        )
+        model_registry.put(self._registry_key(user_id, meal_id), entry)
+        self.version = entry.version
+        self.cache_id = self._cache_id(user_id, meal_id)
+    
+    def _adopt(self, entry: model_registry.LoadedModel, user_id: int, meal_id: int) -> None:
+        # Registry entries are shared read-only; training replaces, never mutates
+        self.model = entry.model
+        self.feature_names = entry.feature_names
+        self.uncertainty = entry.uncertainty
+        self.version = entry.version
+        self.cache_id = self._cache_id(user_id, meal_id)
+    
     def predict(self, recipe_ingredients: List[Dict]) -> float:
         """Predict rating for a recipe based on its ingredients."""
+        return self.predict_with_uncertainty(recipe_ingredients)[0]
+    
+    def predict_with_uncertainty(self, recipe_ingredients: List[Dict]) -> Tuple[float, float]:
+        """
+        Predict rating for a recipe and the standard deviation of that
+        prediction (NaN if the model has no uncertainty state).
+        """
         if self.model is None or self.feature_names is None:
             raise ValueError("Model not trained or loaded")
         
-        # Create feature vector
-        X = np.zeros((1, len(self.feature_names)))
-        for ingredient in recipe_ingredients:
-            key = f"{ingredient['ingredient_id']}_{ingredient['unit']}"
-            if key in self.feature_names:
-                X[0, self.feature_names[key]] = ingredient["quantity"]
-        
-        # Make prediction
-        prediction = self.model.predict(X)[0]
+        with ml_metrics.stage("predict", self.model_type):
+            predictions, std = self._predict_cached(self._vectorize(recipe_ingredients))
         
         # Clamp prediction to valid range (1-10)
-        return max(1.0, min(10.0, prediction))
+        return max(1.0, min(10.0, float(predictions[0]))), float(std[0])
     
     def optimize_recipe(self, recipe_ingredients: List[Dict], 
                        min_adjustment: float = 0.8, 
-                       max_adjustment: float = 1.2) -> Tuple[List[Dict], float, float]:
+                       max_adjustment: float = 1.2,
+                       uncertainty_penalty: float = 0.0) -> Tuple[List[Dict], float, float, float]:
         """
         Optimize a recipe by adjusting ingredient quantities to maximize predicted rating.
-        Returns optimized ingredients, predicted rating, and confidence.
+        Candidates are scored as prediction - uncertainty_penalty * std, so a
+        positive penalty prefers adjustments the model is more certain about.
+        Returns optimized ingredients, predicted rating, confidence and the
+        prediction's standard deviation.
         """
         if self.model is None or self.feature_names is None:
             raise ValueError("Model not trained or loaded")
         
         # Create starting feature vector from current recipe
-        X_base = np.zeros((1, len(self.feature_names)))
-        for ingredient in recipe_ingredients:
-            key = f"{ingredient['ingredient_id']}_{ingredient['unit']}"
-            if key in self.feature_names:
-                X_base[0, self.feature_names[key]] = ingredient["quantity"]
-        
-        # Get base prediction
-        base_prediction = self.model.predict(X_base)[0]
-        
-        # Try different adjustments to find the best one
-        best_adjustments = {}
-        best_prediction = base_prediction
+        X_base = self._vectorize(recipe_ingredients)
         
-        # For each ingredient, try different adjustments
+        # Build every candidate (base recipe first) and score them in one batch
+        adjustments = np.linspace(min_adjustment, max_adjustment, 10)
+        candidate_keys = []
+        rows = [X_base[0]]
         for ingredient in recipe_ingredients:
             key = f"{ingredient['ingredient_id']}_{ingredient['unit']}"
             if key not in self.feature_names:
                 continue
             
             idx = self.feature_names[key]
-            original_quantity = ingredient["quantity"]
-            
-            # Try different adjustment factors
-            adjustments = np.linspace(min_adjustment, max_adjustment, 10)
             for adj in adjustments:
-                # Apply adjustment
-                X_adjusted = X_base.copy()
-                X_adjusted[0, idx] = original_quantity * adj
-                
-                # Predict rating
-                prediction = self.model.predict(X_adjusted)[0]
-                
-                # If better than current best, update
-                if prediction > best_prediction:
-                    best_prediction = prediction
-                    best_adjustments[key] = adj
+                X_adjusted = X_base[0].copy()
+                X_adjusted[idx] = ingredient["quantity"] * adj
+                rows.append(X_adjusted)
+                candidate_keys.append((key, adj))
+        
+        with ml_metrics.stage("candidate_scan", self.model_type):
+            predictions, std = self._predict_cached(np.vstack(rows))
+        ml_metrics.CANDIDATES_EVALUATED.labels(model_type=self.model_type, operation="optimize").inc(len(rows))
+        profiling.annotate(stage="candidate_scan", model_type=self.model_type, candidates=len(rows),
+                           features=len(self.feature_names))
+        penalty = uncertainty_penalty * np.nan_to_num(std)
+        scores = predictions - penalty
+        
+        # Keep every adjustment that beats the running best, as before
+        best_adjustments = {}
+        best_index = 0
+        for i, (key, adj) in enumerate(candidate_keys, start=1):
+            if scores[i] > scores[best_index]:
+                best_index = i
+                best_adjustments[key] = adj
         
         # Apply best adjustments to create optimized recipe
         optimized_ingredients = []
@@ -247,31 +1391,121 @@ class RecipeOptimizer:
                 new_ingredient["quantity"] = ingredient["quantity"] * best_adjustments[key]
             optimized_ingredients.append(new_ingredient)
         
-        # Calculate confidence based on number of recipes used for training
-        # This is a simplified confidence measure
-        model_pipeline = self.model
-        if hasattr(model_pipeline, 'steps') and len(model_pipeline.steps) > 1:
-            model = model_pipeline.steps[-1][1]  # Get the actual model from pipeline
-            if hasattr(model, 'n_samples_seen_'):
-                confidence = min(0.95, 0.5 + (model.n_samples_seen_ / 20))
-            else:
-                confidence = 0.7  # Default if we can't determine from model
-        else:
-            confidence = 0.7
+        best_std = float(std[best_index])
+        confidence = float(uncertainty_to_confidence(best_std))
         
         # Clamp predicted rating to valid range (1-10)
-        best_prediction = max(1.0, min(10.0, best_prediction))
+        best_prediction = max(1.0, min(10.0, float(predictions[best_index])))
         
-        return optimized_ingredients, best_prediction, confidence
+        return optimized_ingredients, best_prediction, confidence, best_std
     
-    def analyze_ingredient_influence(self, recipes: List[Dict]) -> List[Dict]:
+    def response_curves(self, recipe_ingredients: List[Dict],
+                        ingredient_ids: Optional[List[int]] = None,
+                        interactions: Sequence[Tuple[int, int]] = (),
+                        points: int = 25,
+                        grid_points: int = 15,
+                        min_scale: float = 0.0,
+                        max_scale: float = 2.0) -> Dict[str, Any]:
         """
-        Analyze the influence of each ingredient on the recipe rating.
+        Predicted rating as each ingredient's quantity (curves) or a pair of
+        quantities (interaction grids) is scaled from min_scale to max_scale
+        times its amount in the recipe, all other quantities held fixed.
+        Every curve and grid is scored in one batched pass.
         """
-        if len(recipes) < 2:
-            raise ValueError("Need at least 2 recipes to analyze ingredient influence")
+        if self.model is None or self.feature_names is None:
+            raise ValueError("Model not trained or loaded")
         
-        X, y = self._prepare_data(recipes)
+        # Ingredients the model has no feature for cannot change its prediction
+        axes = {}
+        unmodeled = []
+        training_means = self.model.steps[0][1].mean_
+        for ingredient in recipe_ingredients:
+            key = f"{ingredient['ingredient_id']}_{ingredient['unit']}"
+            if key not in self.feature_names:
+                unmodeled.append(ingredient["ingredient_id"])
+                continue
+            idx = self.feature_names[key]
+            # A zero quantity is scaled around the meal's typical amount instead
+            reference = ingredient["quantity"] if ingredient["quantity"] > 0 else float(training_means[idx])
+            axes[ingredient["ingredient_id"]] = (ingredient, idx, reference)
+        
+        selected = list(axes) if ingredient_ids is None else [i for i in ingredient_ids if i in axes]
+        pairs = [(a, b) for a, b in interactions if a in axes and b in axes]
+        scales = np.linspace(min_scale, max_scale, points)
+        grid_scales = np.linspace(min_scale, max_scale, grid_points)
+        
+        # One row for the recipe itself, then each curve and grid as a block
+        # of copies of it with one or two columns overwritten
+        X_base = self._vectorize(recipe_ingredients)[0]
+        curve_rows = len(selected) * points
+        grid_rows = grid_points * grid_points
+        X = np.repeat(X_base[np.newaxis, :], 1 + curve_rows + len(pairs) * grid_rows, axis=0)
+        
+        if selected:
+            columns = np.array([axes[i][1] for i in selected])
+            quantities = np.outer([axes[i][2] for i in selected], scales)
+            X[1 + np.arange(curve_rows).reshape(len(selected), points), columns[:, np.newaxis]] = quantities
+        
+        offset = 1 + curve_rows
+        for a, b in pairs:
+            block = X[offset:offset + grid_rows]
+            block[:, axes[a][1]] = np.repeat(axes[a][2] * grid_scales, grid_points)
+            block[:, axes[b][1]] = np.tile(axes[b][2] * grid_scales, grid_points)
+            offset += grid_rows
+        
+        with ml_metrics.stage("response_curves", self.model_type):
+            predictions, std = self._predict_batch(X)
+        ml_metrics.CANDIDATES_EVALUATED.labels(model_type=self.model_type, operation="response_curves").inc(len(X))
+        profiling.annotate(stage="response_curves", model_type=self.model_type, candidates=len(X),
+                           features=len(self.feature_names))
+        
+        # Clamp predicted ratings to valid range (1-10)
+        # (in float64, so compacted float32 models round cleanly)
+        predictions = np.clip(predictions.astype(float), 1.0, 10.0).round(4)
+        has_std = not np.isnan(std).all()
+        std = std.astype(float).round(4)
+        
+        def _series(start: int, shape: Tuple[int, ...]) -> Dict[str, Any]:
+            end = start + int(np.prod(shape))
+            series = {"predicted": predictions[start:end].reshape(shape).tolist()}
+            if has_std:
+                series["std"] = std[start:end].reshape(shape).tolist()
+            return series
+        
+        def _axis(ingredient_id: int, grid: np.ndarray) -> Dict[str, Any]:
+            ingredient, _, reference = axes[ingredient_id]
+            return {
+                "ingredient_id": ingredient_id,
+                "unit": ingredient["unit"],
+                "quantities": (reference * grid).round(4).tolist()
+            }
+        
+        curves = [
+            {**_axis(ingredient_id, scales), **_series(1 + i * points, (points,))}
+            for i, ingredient_id in enumerate(selected)
+        ]
+        grids = [
+            {"x": _axis(a, grid_scales), "y": _axis(b, grid_scales),
+             **_series(1 + curve_rows + i * grid_rows, (grid_points, grid_points))}
+            for i, (a, b) in enumerate(pairs)
+        ]
+        
+        return {
+            "base_prediction": float(predictions[0]),
+            "base_std": float(std[0]) if has_std else None,
+            "curves": curves,
+            "interactions": grids,
+            "unmodeled": unmodeled
+        }
+    
+    def analyze_ingredient_influence(self, recipes: Union[List[Dict], MealFeatures]) -> List[Dict]:
+        """
+        Analyze the influence of each ingredient on the recipe rating.
+        """
+        if len(recipes) < 2:
+            raise ValueError("Need at least 2 recipes to analyze ingredient influence")
+        
+        X, y = self._prepare_data(recipes)
         
         # Train a simple linear model to get coefficients
         model = LinearRegression()
@@ -281,24 +1515,24 @@ class RecipeOptimizer:
         influences = []
         inverse_feature_names = {v: k for k, v in self.feature_names.items()}
         
+        if isinstance(recipes, MealFeatures):
+            ingredient_names = {str(k): recipes.name(k) for k in recipes.names}
+        else:
+            ingredient_names = {}
+            for recipe in recipes:
+                for ingredient in recipe["ingredients"]:
+                    ingredient_names.setdefault(
+                        str(ingredient["ingredient_id"]), ingredient.get("ingredient_name", "Unknown")
+                    )
+        
         for i, coef in enumerate(model.coef_):
             if i < len(inverse_feature_names):
                 feature_key = inverse_feature_names[i]
-                ingredient_id, unit = feature_key.split('_')
-                
-                # Find ingredient name
-                ingredient_name = None
-                for recipe in recipes:
-                    for ingredient in recipe["ingredients"]:
-                        if str(ingredient["ingredient_id"]) == ingredient_id:
-                            ingredient_name = ingredient.get("ingredient_name", "Unknown")
-                            break
-                    if ingredient_name:
-                        break
+                ingredient_id, unit = feature_key.split('_', 1)
                 
                 influences.append({
                     "ingredient_id": int(ingredient_id),
-                    "ingredient_name": ingredient_name or "Unknown",
+                    "ingredient_name": ingredient_names.get(ingredient_id) or "Unknown",
                     "unit": unit,
                     "influence": coef
                 })
@@ -308,64 +1542,795 @@ class RecipeOptimizer:
         
         return influences
 
-# app/ml/training.py
-from typing import List, Dict, Any
+def preload_hot_models(limit: Optional[int] = None, model_dir: str = "./models") -> int:
+    """
+    Load the most used models into the process-wide registry: in each
+    worker after startup, or in a prefork master before forking so
+    workers share them.
+    """
+    limit = min(settings.ML_PRELOAD_MODELS if limit is None else limit, settings.ML_MODEL_CACHE_SIZE)
+    loaded = 0
+    # Coldest first so the hottest end up most recently used
+    for model_type, user_id, meal_id in reversed(model_registry.hot_models(model_dir, limit)):
+        if model_type not in MODEL_TYPES and model_type != AUTO_MODEL_TYPE:
+            continue
+        if RecipeOptimizer(model_type=model_type, model_dir=model_dir).preload(user_id, meal_id):
+            loaded += 1
+    return loaded
+
+# app/ml/materialized.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+import hashlib
+import json
+import logging
+
+from app.core.config import settings
+from app.ml import metrics as ml_metrics
+from app.ml.feature_store import MealFeatures
 from app.ml.models import RecipeOptimizer
+
+logger = logging.getLogger(__name__)
+
+# One background worker keeps precomputation from competing with requests
+_precompute_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ml-precompute")
+
+def get_recipe_version(recipe_ingredients: List[Dict[str, Any]]) -> str:
+    """Version of a recipe's optimization input: its ingredient rows."""
+    rows = sorted(
+        (int(ing["ingredient_id"]), str(ing["unit"]), float(ing["quantity"]))
+        for ing in recipe_ingredients
+    )
+    return hashlib.sha1(json.dumps(rows).encode("utf-8")).hexdigest()
+
+def precompute_optimizations(
+    optimizer: RecipeOptimizer,
+    user_id: int,
+    meal_id: int,
+    fingerprint: Optional[str],
+    recipes_data: List[Dict[str, Any]],
+    top_n: int
+) -> int:
+    """Optimize the top-N rated recipes with a trained model and persist the results."""
+    top_recipes = sorted(recipes_data, key=lambda r: r["rating"], reverse=True)[:top_n]
+    
+    results = {}
+    for recipe in top_recipes:
+        optimized_ingredients, predicted_rating, confidence, uncertainty = optimizer.optimize_recipe(recipe["ingredients"])
+        results[recipe["id"]] = {
+            "recipe_version": get_recipe_version(recipe["ingredients"]),
+            "optimized_ingredients": optimized_ingredients,
+            "predicted_rating": predicted_rating,
+            "confidence": confidence,
+            "uncertainty": uncertainty
+        }
+    
+    optimizer.save_optimizations(user_id, meal_id, fingerprint, results)
+    return len(results)
+
+def snapshot(optimizer: RecipeOptimizer) -> RecipeOptimizer:
+    """
+    Copy of a trained optimizer's fitted state (model, features, uncertainty
+    and artifact version) that later training cannot change underneath.
+    """
+    copy = RecipeOptimizer(model_type=optimizer.model_type, model_dir=optimizer.model_dir)
+    copy.model = optimizer.model
+    copy.feature_names = dict(optimizer.feature_names)
+    copy.uncertainty = optimizer.uncertainty
+    copy.version = optimizer.version
+    copy.cache_id = optimizer.cache_id
+    return copy
+
+def schedule_precompute(
+    optimizer: RecipeOptimizer,
+    user_id: int,
+    meal_id: int,
+    fingerprint: Optional[str],
+    features: MealFeatures
+) -> None:
+    """Queue precomputation for a freshly trained model, if enabled."""
+    top_n = settings.ML_PRECOMPUTE_TOP_N
+    if top_n <= 0 or optimizer.model is None:
+        return
+    
+    # Work on a snapshot so the caller can keep using its optimizer
+    fitted = snapshot(optimizer)
+    
+    def _run() -> None:
+        try:
+            with ml_metrics.stage("precompute", fitted.model_type):
+                precompute_optimizations(fitted, user_id, meal_id, fingerprint, features.to_recipes_data(), top_n)
+        except Exception as e:
+            logger.error(f"Error precomputing optimizations: {e}")
+    
+    _precompute_executor.submit(_run)
+
+def get_materialized_optimization(
+    optimizer: RecipeOptimizer,
+    user_id: int,
+    meal_id: int,
+    recipe_id: int,
+    fingerprint: str,
+    recipe_version: str
+) -> Optional[Dict[str, Any]]:
+    """Return a stored optimization if both the model and the recipe are unchanged."""
+    stored = optimizer.load_optimizations(user_id, meal_id)
+    if not stored or stored.get("fingerprint") != fingerprint:
+        return None
+    
+    result = stored["results"].get(recipe_id)
+    if not result or result["recipe_version"] != recipe_version:
+        return None
+    
+    return {
+        "optimized_ingredients": result["optimized_ingredients"],
+        "predicted_rating": result["predicted_rating"],
+        "confidence": result["confidence"],
+        "uncertainty": result.get("uncertainty")
+    }
+
+# app/ml/similarity.py
+from typing import List, Dict, Any, Optional, Tuple
+import threading
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+class SimilarityIndex:
+    """
+    Cosine nearest-neighbour index over a meal's recipe feature vectors
+    (one column per ingredient/unit, value = quantity). Rows are stored
+    L2-normalized so a query is a single matrix-vector product.
+    """
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.recipe_ids: List[int] = []
+        self.ratings = np.zeros(0)
+        self.rows = np.zeros((0, 0))
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_matrix(cls, recipe_ids: np.ndarray, ratings: np.ndarray, X: np.ndarray,
+                    keys: List[str]) -> "SimilarityIndex":
+        """Index a recipes x features quantity matrix, normalizing all rows at once."""
+        index = cls()
+        index.vocabulary = {key: i for i, key in enumerate(keys)}
+        index.recipe_ids = [int(recipe_id) for recipe_id in recipe_ids]
+        index.ratings = np.array(ratings, dtype=float)
+        X = np.asarray(X, dtype=float)
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        index.rows = np.divide(X, norms, out=np.zeros_like(X), where=norms > 0)
+        return index
+    
+    def _vectorize(self, ingredients: List[Dict[str, Any]], grow: bool) -> np.ndarray:
+        if grow:
+            for ing in ingredients:
+                key = f"{ing['ingredient_id']}_{ing['unit']}"
+                if key not in self.vocabulary:
+                    self.vocabulary[key] = len(self.vocabulary)
+            if len(self.vocabulary) > self.rows.shape[1]:
+                # New ingredients are zero for existing rows, so norms are unchanged
+                padding = np.zeros((self.rows.shape[0], len(self.vocabulary) - self.rows.shape[1]))
+                self.rows = np.hstack([self.rows, padding])
+        
+        vector = np.zeros(len(self.vocabulary))
+        for ing in ingredients:
+            idx = self.vocabulary.get(f"{ing['ingredient_id']}_{ing['unit']}")
+            if idx is not None:
+                vector[idx] = ing["quantity"]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def upsert(self, recipe_id: int, rating: float, ingredients: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            vector = self._vectorize(ingredients, grow=True)
+            if recipe_id in self.recipe_ids:
+                i = self.recipe_ids.index(recipe_id)
+                self.rows[i] = vector
+                self.ratings[i] = rating
+            else:
+                self.recipe_ids.append(recipe_id)
+                self.rows = np.vstack([self.rows, vector[np.newaxis, :]])
+                self.ratings = np.append(self.ratings, rating)
+    
+    def remove(self, recipe_id: int) -> None:
+        with self._lock:
+            if recipe_id in self.recipe_ids:
+                i = self.recipe_ids.index(recipe_id)
+                del self.recipe_ids[i]
+                self.rows = np.delete(self.rows, i, axis=0)
+                self.ratings = np.delete(self.ratings, i)
+    
+    def _search(self, vector: np.ndarray, k: int, exclude_id: Optional[int]) -> List[Tuple[int, float, float]]:
+        if not self.recipe_ids:
+            return []
+        similarities = self.rows @ vector
+        if exclude_id in self.recipe_ids:
+            similarities[self.recipe_ids.index(exclude_id)] = -np.inf
+        k = min(k, int(np.isfinite(similarities).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [(self.recipe_ids[i], float(similarities[i]), float(self.ratings[i])) for i in top]
+    
+    def neighbors_of(self, recipe_id: int, k: int = 5) -> List[Tuple[int, float, float]]:
+        """Top-k (recipe_id, cosine similarity, rating) closest to an indexed recipe."""
+        with self._lock:
+            if recipe_id not in self.recipe_ids:
+                return []
+            vector = self.rows[self.recipe_ids.index(recipe_id)]
+            return self._search(vector, k, exclude_id=recipe_id)
+    
+    def query(self, ingredients: List[Dict[str, Any]], k: int = 5) -> List[Tuple[int, float, float]]:
+        """Top-k (recipe_id, cosine similarity, rating) closest to an ingredient list."""
+        with self._lock:
+            return self._search(self._vectorize(ingredients, grow=False), k, exclude_id=None)
+    
+    def predict_rating(self, ingredients: List[Dict[str, Any]], k: int = 5) -> Optional[float]:
+        """Similarity-weighted mean rating of the k nearest recipes."""
+        neighbors = self.query(ingredients, k)
+        if not neighbors:
+            return None
+        weights = np.array([max(similarity, 0.0) for _, similarity, _ in neighbors])
+        ratings = np.array([rating for _, _, rating in neighbors])
+        if weights.sum() == 0:
+            return float(ratings.mean())
+        return float(weights @ ratings / weights.sum())
+    
+    def __len__(self) -> int:
+        return len(self.recipe_ids)
+
+# Per-meal indexes with the feature store content hash they were built
+# from. The store is shared by all workers, so a recipe written through any
+# of them changes the hash and the next lookup here rebuilds the index.
+_indexes = TTLCache(
+    maxsize=settings.SIMILARITY_INDEX_MAX_MEALS,
+    ttl=settings.SIMILARITY_INDEX_TTL_SECONDS,
+)
+_build_lock = threading.Lock()
+
+def get_index(db: Session, meal_id: int) -> SimilarityIndex:
+    from app.ml.feature_store import get_meal_features
+    
+    # One stat() while the meal's store file is unchanged
+    features = get_meal_features(db, meal_id)
+    cached = _indexes.get(meal_id)
+    if cached is not None and cached[0] == features.content_hash:
+        return cached[1]
+    
+    with _build_lock:
+        cached = _indexes.get(meal_id)
+        if cached is not None and cached[0] == features.content_hash:
+            return cached[1]
+        index = SimilarityIndex.from_matrix(features.recipe_ids, features.ratings, features.X, features.keys)
+        _indexes.set(meal_id, (features.content_hash, index))
+    return index
+
+def meal_deleted(meal_id: int) -> None:
+    _indexes.pop(meal_id)
+
+# app/ml/suggestions.py
+from datetime import datetime
+from typing import List, Dict, Any, Iterator, Optional
+import time
+
+import numpy as np
+
+from app.ml import metrics as ml_metrics
+from app.ml.models import RecipeOptimizer, uncertainty_to_confidence
+
+class SuggestionGenerator:
+    """
+    Generate novel recipes for a meal by recombining the ingredients and
+    quantity ranges seen in its history. Candidates are sampled and scored
+    in vectorized batches under a strict evaluation budget; near-duplicates
+    are dropped and a diverse top-K is kept and reported after each batch.
+    """
+    def __init__(
+        self,
+        optimizer: RecipeOptimizer,
+        recipes: List[Dict[str, Any]],
+        meal_id: int,
+        k: int = 5,
+        max_candidates: int = 5000,
+        time_budget: float = 2.0,
+        batch_size: int = 512,
+        uncertainty_penalty: float = 0.0,
+        min_relative_difference: float = 0.05,
+        max_similarity: float = 0.99,
+        seed: Optional[int] = None
+    ):
+        self.optimizer = optimizer
+        self.meal_id = meal_id
+        self.k = k
+        self.max_candidates = max_candidates
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.uncertainty_penalty = uncertainty_penalty
+        self.max_similarity = max_similarity
+        self.rng = np.random.default_rng(seed)
+        # Quantities within this relative step land in the same dedupe bin
+        self._log_step = np.log1p(min_relative_difference)
+        
+        feature_names = optimizer.feature_names
+        d = len(feature_names)
+        self.keys = [key for key, _ in sorted(feature_names.items(), key=lambda item: item[1])]
+        counts = np.zeros(d)
+        self.low = np.zeros(d)
+        self.high = np.zeros(d)
+        self.names: Dict[int, str] = {}
+        sizes = []
+        history = []
+        for recipe in recipes:
+            row = np.zeros(d)
+            for ingredient in recipe["ingredients"]:
+                col = feature_names.get(f"{ingredient['ingredient_id']}_{ingredient['unit']}")
+                if col is None:
+                    continue
+                quantity = ingredient["quantity"]
+                self.low[col] = quantity if counts[col] == 0 else min(self.low[col], quantity)
+                self.high[col] = max(self.high[col], quantity)
+                counts[col] += 1
+                row[col] = quantity
+                self.names[int(ingredient["ingredient_id"])] = ingredient.get("ingredient_name", "Unknown")
+            if row.any():
+                sizes.append(int((row > 0).sum()))
+                history.append(row)
+        
+        # Popular ingredients are drawn more often; unseen ones never
+        with np.errstate(divide="ignore"):
+            self.log_popularity = np.log(counts)
+        self.sizes = np.array(sizes or [1])
+        self.history_keys = {self._dedupe_key(row) for row in history}
+        self.top: List[Dict[str, Any]] = []
+        self.evaluated = 0
+    
+    def _dedupe_key(self, row: np.ndarray) -> bytes:
+        with np.errstate(divide="ignore"):
+            bins = np.where(row > 0, np.round(np.log(row) / self._log_step), np.iinfo(np.int32).min)
+        return bins.astype(np.int64).tobytes()
+    
+    def _sample(self, n: int) -> np.ndarray:
+        """Draw n candidate feature rows."""
+        d = len(self.keys)
+        sizes = self.rng.choice(self.sizes, n)
+        # Weighted sampling without replacement per row via Gumbel top-k
+        gumbel = -np.log(-np.log(self.rng.random((n, d))))
+        order = np.argsort(-(self.log_popularity + gumbel), axis=1)
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.broadcast_to(np.arange(d), (n, d)), axis=1)
+        quantities = self.low + self.rng.random((n, d)) * (self.high - self.low)
+        return np.where(ranks < sizes[:, np.newaxis], quantities, 0.0)
+    
+    def _select(self, X: np.ndarray, predictions: np.ndarray, std: np.ndarray) -> None:
+        """Merge a scored batch into the current top-K, keeping it diverse."""
+        pool = self.top + [
+            {"row": X[i], "prediction": predictions[i], "std": std[i],
+             "score": predictions[i] - self.uncertainty_penalty * np.nan_to_num(std[i])}
+            for i in range(len(X))
+        ]
+        pool.sort(key=lambda candidate: candidate["score"], reverse=True)
+        
+        selected: List[Dict[str, Any]] = []
+        for candidate in pool:
+            unit = candidate["row"] / np.linalg.norm(candidate["row"])
+            if all(unit @ chosen["unit"] < self.max_similarity for chosen in selected):
+                candidate["unit"] = unit
+                selected.append(candidate)
+                if len(selected) == self.k:
+                    break
+        self.top = selected
+    
+    def _to_suggestion(self, candidate: Dict[str, Any], created_at: datetime) -> Dict[str, Any]:
+        ingredients = []
+        for col in np.flatnonzero(candidate["row"]):
+            ingredient_id, unit = self.keys[col].split("_", 1)
+            ingredients.append({
+                "ingredient_id": int(ingredient_id),
+                "ingredient_name": self.names.get(int(ingredient_id), "Unknown"),
+                "quantity": float(candidate["row"][col]),
+                "unit": unit
+            })
+        return {
+            "meal_id": self.meal_id,
+            "ingredients": ingredients,
+            "predicted_rating": max(1.0, min(10.0, float(candidate["prediction"]))),
+            "confidence": float(uncertainty_to_confidence(candidate["std"])),
+            "created_at": created_at
+        }
+    
+    def snapshot(self, done: bool) -> Dict[str, Any]:
+        created_at = datetime.utcnow()
+        return {
+            "evaluated": self.evaluated,
+            "done": done,
+            "suggestions": [self._to_suggestion(candidate, created_at) for candidate in self.top]
+        }
+    
+    def run(self) -> Iterator[Dict[str, Any]]:
+        """Yield a snapshot of the current top-K after every scored batch."""
+        deadline = time.perf_counter() + self.time_budget
+        seen = set(self.history_keys)
+        
+        while self.evaluated < self.max_candidates and time.perf_counter() < deadline:
+            X = self._sample(min(self.batch_size, self.max_candidates - self.evaluated))
+            self.evaluated += len(X)
+            
+            novel = []
+            for i, row in enumerate(X):
+                key = self._dedupe_key(row)
+                if row.any() and key not in seen:
+                    seen.add(key)
+                    novel.append(i)
+            
+            if novel:
+                with ml_metrics.stage("candidate_scan", self.optimizer.model_type):
+                    predictions, std = self.optimizer._predict_batch(X[novel])
+                ml_metrics.CANDIDATES_EVALUATED.labels(
+                    model_type=self.optimizer.model_type, operation="suggest"
+                ).inc(len(novel))
+                self._select(X[novel], predictions, std)
+            yield self.snapshot(done=False)
+        
+        yield self.snapshot(done=True)
+
+# app/ml/pooled.py
+from typing import List, Dict, Any, Optional
+import copy
+import os
+import logging
+
+import joblib
+import numpy as np
+from sklearn.linear_model import Ridge
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from app.ml import registry as model_registry
+from app.ml.models import RecipeOptimizer, dump_atomic
+
+logger = logging.getLogger(__name__)
+
+POOLED_MODEL_TYPE = "pooled"
+POOLED_RIDGE_ALPHA = 1.0
+# Pseudo-recipe count pulling each meal's offset toward the user-wide mean
+POOLED_MEAL_SHRINKAGE = 3.0
+
+class PooledRecipeModel:
+    """
+    One model per user trained on all of their recipes: a ridge regression
+    over the shared ingredient vocabulary plus a shrunken per-meal offset
+    (random intercept). Serves meals too sparse for a model of their own.
+    """
+    def __init__(self, model_dir: str = "./models"):
+        self.model_dir = model_dir
+        self.state: Optional[Dict[str, Any]] = None
+        os.makedirs(model_dir, exist_ok=True)
+    
+    def _get_path(self, user_id: int) -> str:
+        return os.path.join(self.model_dir, f"user_{user_id}_pooled.joblib")
+    
+    def _registry_key(self, user_id: int) -> model_registry.ModelKey:
+        # One pooled model per user, whatever the meal
+        return (self.model_dir, POOLED_MODEL_TYPE, user_id, 0)
+    
+    def _remember(self, user_id: int, state: Dict[str, Any]) -> None:
+        # The registry entry's model is the whole state, meal offsets included
+        model_registry.put(self._registry_key(user_id), model_registry.LoadedModel(
+            fingerprint=state.get("fingerprint"),
+            version=str(state.get("fingerprint")),
+            model=state,
+            feature_names=state["feature_names"],
+            uncertainty=state["uncertainty"],
+            metrics=state["metrics"],
+        ))
+    
+    def train(self, recipes: List[Dict], user_id: int, fingerprint: Optional[str] = None) -> Dict[str, Any]:
+        """Fit on recipes from all of a user's meals (each carrying meal_id)."""
+        if len(recipes) < 2:
+            raise ValueError("Need at least 2 recipes to train a model")
+        
+        base = RecipeOptimizer(model_type=POOLED_MODEL_TYPE, model_dir=self.model_dir)
+        X, y = base._prepare_data(recipes)
+        if len(X.columns) == 0:
+            raise ValueError("No features available for training")
+        
+        base.model = Pipeline([
+            ('scaler', StandardScaler()),
+            ('model', Ridge(alpha=POOLED_RIDGE_ALPHA))
+        ])
+        base.model.fit(X, y)
+        base._fit_uncertainty(X, y)
+        
+        residuals = y - base.model.predict(X)
+        meal_ids = np.array([recipe["meal_id"] for recipe in recipes])
+        meal_offsets = {}
+        for meal_id in np.unique(meal_ids):
+            meal_residuals = residuals[meal_ids == meal_id]
+            meal_offsets[int(meal_id)] = float(meal_residuals.sum() / (len(meal_residuals) + POOLED_MEAL_SHRINKAGE))
+        
+        metrics = {
+            "best_score": float(np.mean(residuals ** 2)),
+            "feature_count": len(base.feature_names),
+            "sample_count": len(recipes),
+            "meal_count": len(meal_offsets)
+        }
+        self.state = {
+            "fingerprint": fingerprint,
+            "metrics": metrics,
+            "model": base.model,
+            "feature_names": base.feature_names,
+            "uncertainty": base.uncertainty,
+            "meal_offsets": meal_offsets
+        }
+        dump_atomic(self.state, self._get_path(user_id))
+        self._remember(user_id, self.state)
+        return metrics
+    
+    def load_if_current(self, user_id: int, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Load the pooled model if it was trained on the current data; return its metrics."""
+        cached = model_registry.get(self._registry_key(user_id))
+        if cached is not None and cached.fingerprint == fingerprint:
+            self.state = cached.model
+            return cached.metrics
+        
+        path = self._get_path(user_id)
+        try:
+            if not os.path.exists(path):
+                return None
+            state = joblib.load(path)
+        except Exception as e:
+            logger.error(f"Error loading pooled model: {e}")
+            return None
+        
+        if state.get("fingerprint") != fingerprint:
+            return None
+        self.state = state
+        self._remember(user_id, state)
+        return state["metrics"]
+    
+    def apply_to(self, optimizer: RecipeOptimizer, meal_id: int) -> None:
+        """
+        Make optimizer predict with the pooled model for one meal by folding
+        the meal's offset into the ridge intercept.
+        """
+        scaler, estimator = self.state["model"].steps[0][1], self.state["model"].steps[-1][1]
+        meal_estimator = copy.copy(estimator)
+        meal_estimator.intercept_ = estimator.intercept_ + self.state["meal_offsets"].get(meal_id, 0.0)
+        
+        optimizer.model = Pipeline([('scaler', scaler), ('model', meal_estimator)])
+        optimizer.feature_names = self.state["feature_names"]
+        optimizer.uncertainty = self.state["uncertainty"]
+
+# app/ml/training.py
+from typing import List, Dict, Any, Optional
+from app.ml.models import AUTO_MODEL_TYPE, DEFAULT_MODEL_TYPE, RecipeOptimizer, get_search_config
+from app.ml.feature_store import MealFeatures, get_meal_features
+from app.ml.materialized import schedule_precompute
+from app.ml.pooled import POOLED_MODEL_TYPE, PooledRecipeModel
+from app.ml import metrics as ml_metrics
+from app.core import profiling
+from app.core.concurrency import SingleFlight
+from app.core.config import settings
 from app.db.session import SessionLocal
+from app.models.meal import Meal
 from app.models.recipe import Recipe, RecipeIngredient
-from app.models.ingredient import Ingredient
+from app.services import catalog
+from sqlalchemy import func
 from sqlalchemy.orm import Session
+import hashlib
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
-def get_recipes_data_for_meal(db: Session, meal_id: int) -> List[Dict[str, Any]]:
-    """Get recipe data for a specific meal in the format needed for ML."""
-    recipes = db.query(Recipe).filter(Recipe.meal_id == meal_id).all()
-    
-    recipes_data = []
-    for recipe in recipes:
-        # Get recipe ingredients with ingredient names
-        ingredients_data = []
-        for ri in recipe.ingredients:
-            ingredient = db.query(Ingredient).filter(Ingredient.id == ri.ingredient_id).first()
-            ingredient_name = ingredient.name if ingredient else "Unknown"
-            
-            ingredients_data.append({
-                "ingredient_id": ri.ingredient_id,
-                "ingredient_name": ingredient_name,
-                "quantity": ri.quantity,
-                "unit": ri.unit
-            })
-        
-        recipes_data.append({
-            "id": recipe.id,
-            "rating": recipe.rating,
-            "ingredients": ingredients_data
-        })
+# Identical concurrent trainings (same model, same data) run once
+_training_flight = SingleFlight()
+
+def _data_fingerprint(db: Session, recipe_filter: Any, search_config: Dict[str, Any]) -> str:
+    """
+    Fingerprint recipes matching recipe_filter using aggregates only.
+    Replacing a recipe's ingredients issues new row ids, so max/sum of ids
+    change even when quantities are identical.
+    """
+    recipe_stats = db.query(
+        func.count(Recipe.id),
+        func.sum(Recipe.id),
+        func.sum(Recipe.rating),
+        func.max(Recipe.created_at),
+        func.max(Recipe.updated_at),
+    ).filter(recipe_filter).one()
+    
+    ingredient_stats = db.query(
+        func.count(RecipeIngredient.id),
+        func.sum(RecipeIngredient.id),
+        func.max(RecipeIngredient.id),
+        func.sum(RecipeIngredient.ingredient_id),
+        func.sum(RecipeIngredient.quantity),
+    ).join(Recipe, RecipeIngredient.recipe_id == Recipe.id).filter(recipe_filter).one()
     
-    return recipes_data
+    payload = json.dumps(
+        {
+            "recipes": list(recipe_stats),
+            "ingredients": list(ingredient_stats),
+            "search": search_config,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-def train_model_for_meal(meal_id: int, user_id: int, model_type: str = "random_forest") -> Dict[str, Any]:
-    """Train a model for a specific meal."""
-    try:
-        db = SessionLocal()
-        recipes_data = get_recipes_data_for_meal(db, meal_id)
-        
+def get_training_fingerprint(features: MealFeatures, model_type: str) -> str:
+    """Fingerprint a meal's stored feature matrix and search config."""
+    payload = json.dumps(
+        {"features": features.content_hash, "search": get_search_config(model_type)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_user_training_fingerprint(db: Session, user_id: int) -> str:
+    """Fingerprint all of a user's recipes for the pooled model."""
+    meal_ids = db.query(Meal.id).filter(Meal.user_id == user_id)
+    return _data_fingerprint(db, Recipe.meal_id.in_(meal_ids), {"model_type": POOLED_MODEL_TYPE})
+
+def _query_recipes_data(db: Session, recipe_filter: Any) -> List[Dict[str, Any]]:
+    """Get recipes matching recipe_filter, tagged with their meal, in one query."""
+    rows = db.query(
+        Recipe.id, Recipe.meal_id, Recipe.rating,
+        RecipeIngredient.ingredient_id, RecipeIngredient.quantity, RecipeIngredient.unit
+    ).join(Meal, Recipe.meal_id == Meal.id).outerjoin(
+        RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id
+    ).filter(recipe_filter).order_by(Recipe.id).all()
+    
+    ingredient_catalog = catalog.get_catalog(db)
+    recipes_data: Dict[int, Dict[str, Any]] = {}
+    for recipe_id, meal_id, rating, ingredient_id, quantity, unit in rows:
+        recipe = recipes_data.setdefault(recipe_id, {
+            "id": recipe_id,
+            "meal_id": meal_id,
+            "rating": rating,
+            "ingredients": []
+        })
+        if ingredient_id is not None:
+            recipe["ingredients"].append({
+                "ingredient_id": ingredient_id,
+                "ingredient_name": ingredient_catalog.name(ingredient_id),
+                "quantity": quantity,
+                "unit": unit
+            })
+    return list(recipes_data.values())
+
+def get_recipes_data_for_user(db: Session, user_id: int) -> List[Dict[str, Any]]:
+    """Get every recipe of a user, tagged with its meal."""
+    return _query_recipes_data(db, Meal.user_id == user_id)
+
+def ensure_pooled_model(
+    db: Session,
+    optimizer: RecipeOptimizer,
+    user_id: int,
+    meal_id: int
+) -> Dict[str, Any]:
+    """
+    Point optimizer at the user's pooled model for meal_id, training the
+    pooled model first if the user's data changed.
+    """
+    pooled = PooledRecipeModel(model_dir=optimizer.model_dir)
+    with ml_metrics.stage("fingerprint", POOLED_MODEL_TYPE):
+        fingerprint = get_user_training_fingerprint(db, user_id)
+    metrics = pooled.load_if_current(user_id, fingerprint)
+    retrained = metrics is None
+    ml_metrics.cache_result(POOLED_MODEL_TYPE, "model", hit=not retrained)
+    if retrained:
+        with ml_metrics.stage("fetch", POOLED_MODEL_TYPE):
+            recipes_data = get_recipes_data_for_user(db, user_id)
         if len(recipes_data) < 2:
             return {
                 "success": False,
                 "error": "Need at least 2 recipes to train a model",
                 "status_code": 400
             }
+        def _train() -> Dict[str, Any]:
+            ml_metrics.IMPLICIT_RETRAINS.labels(model_type=POOLED_MODEL_TYPE).inc()
+            with ml_metrics.stage("fit", POOLED_MODEL_TYPE):
+                return pooled.train(recipes_data, user_id, fingerprint=fingerprint)
         
+        metrics, shared = _training_flight.do((POOLED_MODEL_TYPE, user_id, fingerprint), _train)
+        if shared:
+            pooled.load_if_current(user_id, fingerprint)
+    
+    pooled.apply_to(optimizer, meal_id)
+    return {"success": True, "metrics": metrics, "retrained": retrained, "source": POOLED_MODEL_TYPE}
+
+def uses_pooled_model(optimizer: RecipeOptimizer, features: MealFeatures, pooled_fallback: bool) -> bool:
+    """
+    Whether the meal is served by the user's pooled model: it must be
+    enabled, the meal sparse, and the request either for model_type=auto
+    or for no model type in particular (pooled_fallback).
+    """
+    return (settings.ML_POOLED_MODEL_ENABLED
+            and (pooled_fallback or optimizer.model_type == AUTO_MODEL_TYPE)
+            and len(features) < settings.ML_POOLED_MIN_MEAL_RECIPES)
+
+def ensure_trained_model(
+    db: Session,
+    optimizer: RecipeOptimizer,
+    user_id: int,
+    meal_id: int,
+    features: Optional[MealFeatures] = None,
+    fingerprint: Optional[str] = None,
+    pooled_fallback: bool = False
+) -> Dict[str, Any]:
+    """
+    Load the persisted model if it matches the meal's current data,
+    otherwise (re)train it. Sparse meals are served by the user's pooled
+    model (see uses_pooled_model); a requested model type other than auto
+    is always trained per meal.
+    """
+    if features is None:
+        with ml_metrics.stage("features", optimizer.model_type):
+            features = get_meal_features(db, meal_id)
+    profiling.annotate(stage="features", model_type=optimizer.model_type, meal_id=meal_id,
+                       recipes=len(features), features=len(features.keys))
+    
+    if uses_pooled_model(optimizer, features, pooled_fallback):
+        return ensure_pooled_model(db, optimizer, user_id, meal_id)
+    
+    if fingerprint is None:
+        fingerprint = get_training_fingerprint(features, optimizer.model_type)
+    metrics = optimizer.load_if_current(user_id, meal_id, fingerprint)
+    ml_metrics.cache_result(optimizer.model_type, "model", hit=metrics is not None)
+    if metrics is not None:
+        return {"success": True, "metrics": metrics, "retrained": False, "source": "meal"}
+    
+    if len(features) < 2:
+        return {
+            "success": False,
+            "error": "Need at least 2 recipes to train a model",
+            "status_code": 400
+        }
+    
+    def _train() -> Dict[str, Any]:
+        ml_metrics.IMPLICIT_RETRAINS.labels(model_type=optimizer.model_type).inc()
+        if optimizer.model_type == AUTO_MODEL_TYPE:
+            metrics = optimizer.train_all(features, user_id, meal_id, fingerprint=fingerprint)
+        else:
+            metrics = optimizer.train(features, user_id, meal_id, fingerprint=fingerprint)
+        schedule_precompute(optimizer, user_id, meal_id, fingerprint, features)
+        return metrics
+    
+    metrics, shared = _training_flight.do((optimizer.model_type, user_id, meal_id, fingerprint), _train)
+    if shared:
+        # Another request trained this exact model; load its artifacts
+        optimizer.load_if_current(user_id, meal_id, fingerprint)
+    return {"success": True, "metrics": metrics, "retrained": True, "source": "meal"}
+
+def get_recipes_data_for_meal(db: Session, meal_id: int) -> List[Dict[str, Any]]:
+    """Get recipe data for a specific meal in the format needed for ML."""
+    return _query_recipes_data(db, Recipe.meal_id == meal_id)
+
+def train_model_for_meal(meal_id: int, user_id: int, model_type: Optional[str] = None) -> Dict[str, Any]:
+    """Train a model for a specific meal."""
+    try:
+        db = SessionLocal()
+        pooled_fallback = model_type is None
+        model_type = model_type or DEFAULT_MODEL_TYPE
         optimizer = RecipeOptimizer(model_type=model_type)
-        metrics = optimizer.train(recipes_data, user_id, meal_id)
+        result = ensure_trained_model(db, optimizer, user_id, meal_id, pooled_fallback=pooled_fallback)
+        
+        if not result["success"]:
+            return result
         
         return {
             "success": True,
-            "metrics": metrics,
-            "model_type": model_type
+            "metrics": result["metrics"],
+            "model_type": model_type,
+            "retrained": result["retrained"],
+            "source": result["source"]
         }
     except Exception as e:
         logger.error(f"Error training model: {e}")
@@ -379,43 +2344,85 @@ def train_model_for_meal(meal_id: int, user_id: int, model_type: str = "random_f
 
 # app/ml/prediction.py
 from typing import List, Dict, Any, Optional, Tuple
-from app.ml.models import RecipeOptimizer
+from app.ml.models import DEFAULT_MODEL_TYPE, RecipeOptimizer, uncertainty_to_confidence
+from app.ml.materialized import get_materialized_optimization, get_recipe_version
+from app.ml import similarity
+from app.ml.suggestions import SuggestionGenerator
+from app.ml import metrics as ml_metrics
+from app.ml.feature_store import get_meal_features
+from app.ml.training import ensure_trained_model, get_training_fingerprint, uses_pooled_model
+from app.ml.pooled import POOLED_MODEL_TYPE
+from app.core.concurrency import SingleFlight
+from app.core.config import settings
 from app.db.session import SessionLocal
-from app.models.recipe import Recipe, RecipeIngredient
-from app.models.ingredient import Ingredient
+from app.models.recipe import Recipe
 from app.models.meal import Meal
-from sqlalchemy.orm import Session
 import logging
+import math
 
 logger = logging.getLogger(__name__)
 
-def predict_recipe_rating(recipe_ingredients: List[Dict], user_id: int, meal_id: int, model_type: str = "random_forest") -> Dict[str, Any]:
+# Identical concurrent optimize requests (same recipe data and options) run once
+_optimize_flight = SingleFlight()
+
+def _json_float(value: float) -> Optional[float]:
+    # NaN (no uncertainty state) is not valid JSON
+    return None if value is None or math.isnan(value) else value
+
+def _method(model_result: Dict[str, Any]) -> str:
+    # Sparse meals may be answered by the user's pooled model
+    return "pooled" if model_result.get("source") == POOLED_MODEL_TYPE else "model"
+
+def predict_recipe_rating(recipe_ingredients: List[Dict], user_id: int, meal_id: int,
+                          model_type: Optional[str] = None) -> Dict[str, Any]:
     """Predict rating for a recipe based on its ingredients."""
     try:
-        optimizer = RecipeOptimizer(model_type=model_type)
+        pooled_fallback = model_type is None
+        optimizer = RecipeOptimizer(model_type=model_type or DEFAULT_MODEL_TYPE)
         
-        # Try to load existing model
-        if not optimizer.load(user_id, meal_id):
-            # If model doesn't exist, train a new one
-            db = SessionLocal()
-            recipes_data = get_recipes_data_for_meal(db, meal_id)
-            db.close()
-            
-            if len(recipes_data) < 2:
+        # Load the existing model, retraining only if the meal's data changed
+        db = SessionLocal()
+        try:
+            # Check if meal belongs to user before touching its recipes
+            owner_id = db.query(Meal.user_id).filter(Meal.id == meal_id).scalar()
+            if owner_id is None:
                 return {
                     "success": False,
-                    "error": "Need at least 2 recipes to train a model",
-                    "status_code": 400
+                    "error": "Meal not found",
+                    "status_code": 404
+                }
+            if owner_id != user_id:
+                return {
+                    "success": False,
+                    "error": "Not authorized to access this meal",
+                    "status_code": 403
                 }
             
-            optimizer.train(recipes_data, user_id, meal_id)
+            model_result = ensure_trained_model(db, optimizer, user_id, meal_id, pooled_fallback=pooled_fallback)
+            if not model_result["success"] and model_result.get("status_code") == 400:
+                # Too few recipes for a model: fall back to nearest neighbours
+                knn_rating = similarity.get_index(db, meal_id).predict_rating(recipe_ingredients)
+                if knn_rating is not None:
+                    return {
+                        "success": True,
+                        "predicted_rating": knn_rating,
+                        "method": "knn"
+                    }
+        finally:
+            db.close()
+        
+        if not model_result["success"]:
+            return model_result
         
         # Predict rating
-        predicted_rating = optimizer.predict(recipe_ingredients)
+        predicted_rating, uncertainty = optimizer.predict_with_uncertainty(recipe_ingredients)
         
         return {
             "success": True,
-            "predicted_rating": predicted_rating
+            "predicted_rating": predicted_rating,
+            "method": _method(model_result),
+            "confidence": float(uncertainty_to_confidence(uncertainty)),
+            "uncertainty": _json_float(uncertainty)
         }
     except Exception as e:
         logger.error(f"Error predicting recipe rating: {e}")
@@ -425,14 +2432,85 @@ def predict_recipe_rating(recipe_ingredients: List[Dict], user_id: int, meal_id:
             "status_code": 500
         }
 
-def optimize_recipe(recipe_id: int, user_id: int, model_type: str = "random_forest") -> Dict[str, Any]:
+def response_curves(recipe_ingredients: List[Dict], user_id: int, meal_id: int,
+                    model_type: Optional[str] = None,
+                    ingredient_ids: Optional[List[int]] = None,
+                    interactions: Optional[List[Tuple[int, int]]] = None,
+                    points: int = 25, grid_points: int = 15,
+                    min_scale: float = 0.0, max_scale: float = 2.0) -> Dict[str, Any]:
+    """Predicted rating curves and interaction grids over ingredient quantities."""
+    try:
+        interactions = interactions or []
+        recipe_ids = {ingredient["ingredient_id"] for ingredient in recipe_ingredients}
+        requested = set(ingredient_ids or []) | {i for pair in interactions for i in pair}
+        if requested - recipe_ids:
+            return {
+                "success": False,
+                "error": f"Ingredients not in recipe: {', '.join(map(str, sorted(requested - recipe_ids)))}",
+                "status_code": 400
+            }
+        if any(a == b for a, b in interactions):
+            return {
+                "success": False,
+                "error": "An interaction needs two different ingredients",
+                "status_code": 400
+            }
+        if min_scale >= max_scale:
+            return {
+                "success": False,
+                "error": "min_scale must be below max_scale",
+                "status_code": 400
+            }
+        
+        curve_count = len(recipe_ids) if ingredient_ids is None else len(set(ingredient_ids))
+        rows = 1 + curve_count * points + len(interactions) * grid_points * grid_points
+        if rows > settings.RESPONSE_CURVE_MAX_ROWS:
+            return {
+                "success": False,
+                "error": f"Request needs {rows} predictions; the limit is {settings.RESPONSE_CURVE_MAX_ROWS}",
+                "status_code": 400
+            }
+        
+        # Load the existing model, retraining only if the meal's data changed
+        pooled_fallback = model_type is None
+        model_type = model_type or DEFAULT_MODEL_TYPE
+        optimizer = RecipeOptimizer(model_type=model_type)
+        db = SessionLocal()
+        try:
+            model_result = ensure_trained_model(db, optimizer, user_id, meal_id, pooled_fallback=pooled_fallback)
+        finally:
+            db.close()
+        
+        if not model_result["success"]:
+            return model_result
+        
+        curves = optimizer.response_curves(
+            recipe_ingredients, ingredient_ids=ingredient_ids, interactions=interactions,
+            points=points, grid_points=grid_points, min_scale=min_scale, max_scale=max_scale
+        )
+        
+        return {"success": True, "model_type": model_type, "method": _method(model_result), **curves}
+    except Exception as e:
+        logger.error(f"Error computing response curves: {e}")
+        return {
+            "success": False,
+            "error": str(e),
+            "status_code": 500
+        }
+
+def optimize_recipe(recipe_id: int, user_id: int, model_type: Optional[str] = None,
+                    uncertainty_penalty: float = 0.0) -> Dict[str, Any]:
     """Optimize a recipe by adjusting ingredient quantities."""
     try:
+        pooled_fallback = model_type is None
+        model_type = model_type or DEFAULT_MODEL_TYPE
         db = SessionLocal()
         
-        # Get recipe and its meal
-        recipe = db.query(Recipe).filter(Recipe.id == recipe_id).first()
-        if not recipe:
+        # Get the recipe's meal and owner
+        row = db.query(Recipe.meal_id, Meal.user_id).join(
+            Meal, Recipe.meal_id == Meal.id
+        ).filter(Recipe.id == recipe_id).first()
+        if not row:
             db.close()
             return {
                 "success": False,
@@ -440,11 +2518,10 @@ def optimize_recipe(recipe_id: int, user_id: int, model_type: str = "random_fore
                 "status_code": 404
             }
         
-        meal_id = recipe.meal_id
-        meal = db.query(Meal).filter(Meal.id == meal_id).first()
+        meal_id, owner_id = row
         
         # Check if meal belongs to user
-        if meal.user_id != user_id:
+        if owner_id != user_id:
             db.close()
             return {
                 "success": False,
@@ -452,46 +2529,65 @@ def optimize_recipe(recipe_id: int, user_id: int, model_type: str = "random_fore
                 "status_code": 403
             }
         
-        # Get recipe ingredients with ingredient names
-        recipe_ingredients = []
-        for ri in recipe.ingredients:
-            ingredient = db.query(Ingredient).filter(Ingredient.id == ri.ingredient_id).first()
-            ingredient_name = ingredient.name if ingredient else "Unknown"
-            
-            recipe_ingredients.append({
-                "ingredient_id": ri.ingredient_id,
-                "ingredient_name": ingredient_name,
-                "quantity": ri.quantity,
-                "unit": ri.unit
-            })
+        # Recipe ingredients come from the meal's feature store
+        with ml_metrics.stage("features", model_type):
+            features = get_meal_features(db, meal_id)
+            recipe_ingredients = features.recipe_ingredients(recipe_id)
+            if recipe_ingredients is None:
+                features = get_meal_features(db, meal_id, rebuild=True)
+                recipe_ingredients = features.recipe_ingredients(recipe_id) or []
         
-        # Try to load existing model
         optimizer = RecipeOptimizer(model_type=model_type)
-        if not optimizer.load(user_id, meal_id):
-            # If model doesn't exist, train a new one
-            recipes_data = get_recipes_data_for_meal(db, meal_id)
+        fingerprint = get_training_fingerprint(features, model_type)
+        pooled = uses_pooled_model(optimizer, features, pooled_fallback)
+        
+        def _compute() -> Dict[str, Any]:
+            # Serve the precomputed result when model and recipe are unchanged
+            # (precomputation uses no uncertainty penalty and per-meal models)
+            materialized = None
+            if uncertainty_penalty == 0.0 and not pooled:
+                with ml_metrics.stage("materialized_lookup", model_type):
+                    materialized = get_materialized_optimization(
+                        optimizer, user_id, meal_id, recipe_id, fingerprint,
+                        get_recipe_version(recipe_ingredients)
+                    )
+                ml_metrics.cache_result(model_type, "materialized", hit=materialized is not None)
+            if materialized is not None:
+                materialized["uncertainty"] = _json_float(materialized["uncertainty"])
+                return {"success": True, "materialized": True, "method": "model", **materialized}
             
-            if len(recipes_data) < 2:
-                db.close()
-                return {
-                    "success": False,
-                    "error": "Need at least 2 recipes to train a model",
-                    "status_code": 400
-                }
+            # Load the existing model, retraining only if the meal's data changed
+            model_result = ensure_trained_model(
+                db, optimizer, user_id, meal_id, features=features, fingerprint=fingerprint,
+                pooled_fallback=pooled_fallback
+            )
+            
+            if not model_result["success"]:
+                return model_result
             
-            optimizer.train(recipes_data, user_id, meal_id)
+            # Optimize recipe
+            optimized_ingredients, predicted_rating, confidence, uncertainty = optimizer.optimize_recipe(
+                recipe_ingredients, uncertainty_penalty=uncertainty_penalty
+            )
+            
+            return {
+                "success": True,
+                "materialized": False,
+                "method": _method(model_result),
+                "optimized_ingredients": optimized_ingredients,
+                "predicted_rating": predicted_rating,
+                "confidence": confidence,
+                "uncertainty": _json_float(uncertainty)
+            }
         
-        # Optimize recipe
-        optimized_ingredients, predicted_rating, confidence = optimizer.optimize_recipe(recipe_ingredients)
+        # Requests for the same recipe data and options share one computation
+        result, _ = _optimize_flight.do(
+            (user_id, recipe_id, model_type, pooled, uncertainty_penalty, fingerprint), _compute
+        )
         
         db.close()
         
-        return {
-            "success": True,
-            "optimized_ingredients": optimized_ingredients,
-            "predicted_rating": predicted_rating,
-            "confidence": confidence
-        }
+        return dict(result)
     except Exception as e:
         logger.error(f"Error optimizing recipe: {e}")
         if 'db' in locals():
@@ -526,9 +2622,10 @@ def analyze_ingredient_influence(meal_id: int, user_id: int, model_type: str = "
             }
         
         # Get recipe data
-        recipes_data = get_recipes_data_for_meal(db, meal_id)
+        with ml_metrics.stage("features", model_type):
+            features = get_meal_features(db, meal_id)
         
-        if len(recipes_data) < 2:
+        if len(features) < 2:
             db.close()
             return {
                 "success": False,
@@ -538,10 +2635,10 @@ def analyze_ingredient_influence(meal_id: int, user_id: int, model_type: str = "
         
         # Use linear model for coefficient analysis
         optimizer = RecipeOptimizer(model_type="linear")
-        optimizer.train(recipes_data, user_id, meal_id)
+        ensure_trained_model(db, optimizer, user_id, meal_id, features=features)
         
         # Analyze ingredient influence
-        influences = optimizer.analyze_ingredient_influence(recipes_data)
+        influences = optimizer.analyze_ingredient_influence(features)
         
         db.close()
         
@@ -559,29 +2656,48 @@ def analyze_ingredient_influence(meal_id: int, user_id: int, model_type: str = "
             "status_code": 500
         }
 
-def get_recipes_data_for_meal(db: Session, meal_id: int) -> List[Dict[str, Any]]:
-    """Get recipe data for a specific meal in the format needed for ML."""
-    recipes = db.query(Recipe).filter(Recipe.meal_id == meal_id).all()
-    
-    recipes_data = []
-    for recipe in recipes:
-        # Get recipe ingredients with ingredient names
-        ingredients_data = []
-        for ri in recipe.ingredients:
-            ingredient = db.query(Ingredient).filter(Ingredient.id == ri.ingredient_id).first()
-            ingredient_name = ingredient.name if ingredient else "Unknown"
-            
-            ingredients_data.append({
-                "ingredient_id": ri.ingredient_id,
-                "ingredient_name": ingredient_name,
-                "quantity": ri.quantity,
-                "unit": ri.unit
-            })
+def suggest_recipes(meal_id: int, user_id: int, model_type: Optional[str] = None,
+                    k: int = 5, uncertainty_penalty: float = 0.0) -> Dict[str, Any]:
+    """
+    Prepare a suggestion search for a meal. On success "snapshots" is an
+    iterator of progressively better top-K suggestion lists.
+    """
+    try:
+        pooled_fallback = model_type is None
+        model_type = model_type or DEFAULT_MODEL_TYPE
+        db = SessionLocal()
+        try:
+            with ml_metrics.stage("features", model_type):
+                features = get_meal_features(db, meal_id)
+            optimizer = RecipeOptimizer(model_type=model_type)
+            model_result = ensure_trained_model(
+                db, optimizer, user_id, meal_id, features=features, pooled_fallback=pooled_fallback
+            )
+        finally:
+            db.close()
         
-        recipes_data.append({
-            "id": recipe.id,
-            "rating": recipe.rating,
-            "ingredients": ingredients_data
-        })
-    
-    return recipes_data
\ No newline at end of file
+        if not model_result["success"]:
+            return model_result
+        
+        generator = SuggestionGenerator(
+            optimizer,
+            features.to_recipes_data(),
+            meal_id,
+            k=k,
+            max_candidates=settings.SUGGESTION_MAX_CANDIDATES,
+            time_budget=settings.SUGGESTION_TIME_BUDGET_SECONDS,
+            batch_size=settings.SUGGESTION_BATCH_SIZE,
+            uncertainty_penalty=uncertainty_penalty
+        )
+        
+        return {
+            "success": True,
+            "snapshots": generator.run()
+        }
+    except Exception as e:
+        logger.error(f"Error suggesting recipes: {e}")
+        return {
+            "success": False,
+            "error": str(e),
+            "status_code": 500
+        }
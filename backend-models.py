@@ -5,11 +5,182 @@ from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
 
-engine = create_engine(settings.DATABASE_URI)
+# SQLite connections are shared with FastAPI's worker threads
+connect_args = {"check_same_thread": False} if settings.DATABASE_URI.startswith("sqlite") else {}
+engine = create_engine(settings.DATABASE_URI, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# app/db/instrumentation.py
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class RequestQueryStats:
+    """
+    SQL statements and DB time attributed to one request.
+    """
+    __slots__ = ("scope", "count", "duration_ms")
+
+    def __init__(self, scope: Dict[str, Any]):
+        self.scope = scope
+        self.count = 0
+        self.duration_ms = 0.0
+
+    @property
+    def route(self) -> str:
+        return route_label(self.scope)
+
+class QueryBudget:
+    """
+    Statements executed inside a query_budget() block, from any thread.
+    """
+    def __init__(self, max_queries: int):
+        self.max_queries = max_queries
+        self.statements: List[str] = []
+
+_current: ContextVar[Optional[RequestQueryStats]] = ContextVar("request_query_stats", default=None)
+_budgets: List[QueryBudget] = []
+_route_stats: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+_endpoint_paths: Dict[Any, str] = {}
+
+def route_label(scope: Dict[str, Any]) -> str:
+    # Label by route template so /recipes/1 and /recipes/2 aggregate
+    # together. The router records the matched endpoint in the scope.
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not _endpoint_paths and scope.get("app") is not None:
+        for route in scope["app"].routes:
+            if hasattr(route, "endpoint") and hasattr(route, "path"):
+                _endpoint_paths.setdefault(route.endpoint, route.path)
+    path = _endpoint_paths.get(endpoint) or f"{endpoint.__module__}.{endpoint.__name__}"
+    return f"{scope.get('method', '')} {path}"
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any,
+                           context: Any, executemany: bool) -> None:
+    conn.info["query_start"] = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn: Any, cursor: Any, statement: str, parameters: Any,
+                          context: Any, executemany: bool) -> None:
+    started = conn.info.pop("query_start", None)
+    if started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration_ms += elapsed_ms
+    
+    if elapsed_ms >= settings.DB_SLOW_QUERY_MS:
+        logger.warning(
+            "Slow query (%.1fms) in %s: %s",
+            elapsed_ms, stats.route if stats is not None else "background", statement
+        )
+    
+    if _budgets:
+        with _lock:
+            for budget in _budgets:
+                budget.statements.append(statement)
+
+def record_request(stats: RequestQueryStats) -> None:
+    route = stats.route
+    with _lock:
+        totals = _route_stats.setdefault(route, {
+            "requests": 0, "queries": 0, "db_ms": 0.0, "max_queries": 0
+        })
+        totals["requests"] += 1
+        totals["queries"] += stats.count
+        totals["db_ms"] += stats.duration_ms
+        totals["max_queries"] = max(totals["max_queries"], stats.count)
+
+def route_stats() -> Dict[str, Dict[str, float]]:
+    """Per-route totals since startup, with per-request averages."""
+    with _lock:
+        return {
+            route: {
+                **totals,
+                "avg_queries": totals["queries"] / totals["requests"],
+                "avg_db_ms": totals["db_ms"] / totals["requests"],
+            }
+            for route, totals in sorted(_route_stats.items())
+        }
+
+def reset_route_stats() -> None:
+    with _lock:
+        _route_stats.clear()
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware counting SQL statements and DB time per request.
+    Adds a Server-Timing header and feeds the per-route aggregates.
+    """
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        stats = RequestQueryStats(scope)
+        token = _current.set(stats)
+        
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((
+                    b"server-timing",
+                    f'db;dur={stats.duration_ms:.1f};desc="{stats.count} queries"'.encode()
+                ))
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            record_request(stats)
+
+@contextmanager
+def query_budget(max_queries: int) -> Iterator[QueryBudget]:
+    """
+    Test helper: fail if more than max_queries statements run in the block.
+    Counts statements from every thread, so it works around TestClient calls:
+
+        with query_budget(3):
+            client.get("/api/v1/recipes/1", headers=auth)
+    """
+    budget = QueryBudget(max_queries)
+    with _lock:
+        _budgets.append(budget)
+    try:
+        yield budget
+    finally:
+        with _lock:
+            _budgets.remove(budget)
+    if len(budget.statements) > max_queries:
+        raise AssertionError(
+            f"Expected at most {max_queries} queries, got {len(budget.statements)}:\n"
+            + "\n".join(budget.statements)
+        )
+
 # app/models/user.py
 from sqlalchemy import Boolean, Column, Integer, String, DateTime
 from sqlalchemy.orm import relationship
@@ -103,6 +274,13 @@ class RecipeIngredient(Base):
     recipe = relationship("Recipe", back_populates="ingredients")
     ingredient = relationship("Ingredient", back_populates="recipe_ingredients")
 
+    @property
+    def ingredient_name(self) -> str:
+        # Resolved from the in-process catalog instead of lazy-loading
+        # self.ingredient once per row
+        from app.services import catalog
+        return catalog.get_name(self.ingredient_id)
+
 # app/models/ingredient.py
 from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime
 from sqlalchemy.orm import relationship
@@ -123,7 +301,7 @@ class Ingredient(Base):
     recipe_ingredients = relationship("RecipeIngredient", back_populates="ingredient")
 
 # app/models/social_share.py
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime, timedelta
@@ -132,6 +310,12 @@ from app.db.base import Base
 
 class SocialShare(Base):
     __tablename__ = "social_shares"
+    __table_args__ = (
+        # Shares of a recipe, optionally only the live ones (expiry_date > now)
+        Index("ix_social_shares_recipe_id_expiry_date", "recipe_id", "expiry_date"),
+        # Oldest-first range scans for the expired-share sweeper
+        Index("ix_social_shares_expiry_date", "expiry_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     recipe_id = Column(Integer, ForeignKey("recipes.id"))
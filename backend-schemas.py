@@ -208,10 +208,22 @@ class IngredientInDB(IngredientInDBBase):
     pass
 
 # app/schemas/ml.py
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pydantic import BaseModel, Field
 from datetime import datetime
-from .recipe import MeasurementUnit, RecipeIngredient
+from enum import Enum
+from .recipe import MeasurementUnit, RecipeIngredientBase
+
+# Model types accepted by the ML endpoints: app.ml.models.MODEL_TYPES plus
+# "auto". Validated up front since the value labels metrics and names files.
+class ModelType(str, Enum):
+    LINEAR = 'linear'
+    RIDGE = 'ridge'
+    LASSO = 'lasso'
+    RANDOM_FOREST = 'random_forest'
+    GRADIENT_BOOSTING = 'gradient_boosting'
+    SVR = 'svr'
+    AUTO = 'auto'
 
 class IngredientInfluence(BaseModel):
     ingredient_id: int
@@ -219,10 +231,14 @@ class IngredientInfluence(BaseModel):
     unit: MeasurementUnit
     influence: float
 
+# Ingredient of a generated (not yet saved) recipe
+class SuggestedIngredient(RecipeIngredientBase):
+    ingredient_name: str
+
 class RecipeSuggestion(BaseModel):
-    id: int
+    id: Optional[int] = None
     meal_id: int
-    ingredients: List[RecipeIngredient]
+    ingredients: List[SuggestedIngredient]
     predicted_rating: float = Field(..., ge=1.0, le=10.0)
     confidence: float = Field(..., ge=0.0, le=1.0)
     created_at: datetime
@@ -230,6 +246,18 @@ class RecipeSuggestion(BaseModel):
     class Config:
         orm_mode = True
 
+class ResponseCurveRequest(BaseModel):
+    ingredients: List[RecipeIngredientBase]
+    # Ingredients to draw a curve for; every modeled ingredient when omitted
+    ingredient_ids: Optional[List[int]] = None
+    # Pairs of ingredient ids to vary together on a grid
+    interactions: List[Tuple[int, int]] = Field(default_factory=list, max_items=10)
+    points: int = Field(25, ge=2, le=100)
+    grid_points: int = Field(15, ge=2, le=50)
+    # Quantities range from min_scale to max_scale times the recipe's
+    min_scale: float = Field(0.0, ge=0.0)
+    max_scale: float = Field(2.0, gt=0.0, le=10.0)
+
 # app/schemas/social.py
 from typing import Optional
 from datetime import datetime